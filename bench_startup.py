@@ -0,0 +1,98 @@
+"""Startup benchmark for the scraper CLI and AliExpressScraper construction
+
+Usage: python bench_startup.py [--runs N] [--selenium]
+
+Reports the median wall time of ``python main.py --help`` in a fresh
+interpreter, and of importing ``main`` and constructing the scraper. With
+--selenium the construction is timed with use_selenium=True (Chrome is not
+launched until the first navigation, so this should match the plain case),
+and the first ``scraper.driver`` access is timed separately.
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+CONSTRUCT_SCRIPT = """
+import sys, time
+start = time.perf_counter()
+import main
+imported = time.perf_counter()
+scraper = main.AliExpressScraper(output_dir=sys.argv[1], use_selenium=sys.argv[2] == "1")
+constructed = time.perf_counter()
+launched = constructed
+if sys.argv[3] == "1":
+    scraper.driver
+    launched = time.perf_counter()
+scraper.close()
+print(imported - start, constructed - imported, launched - constructed)
+"""
+
+
+def time_cli(runs):
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(
+            [sys.executable, os.path.join(HERE, "main.py"), "--help"],
+            cwd=HERE,
+            stdout=subprocess.DEVNULL,
+            check=True,
+        )
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples)
+
+
+def time_construction(runs, use_selenium, launch):
+    columns = ([], [], [])
+    with tempfile.TemporaryDirectory() as output_dir:
+        for _ in range(runs):
+            result = subprocess.run(
+                [
+                    sys.executable,
+                    "-c",
+                    CONSTRUCT_SCRIPT,
+                    output_dir,
+                    "1" if use_selenium else "0",
+                    "1" if launch else "0",
+                ],
+                cwd=HERE,
+                capture_output=True,
+                text=True,
+                check=True,
+            )
+            for column, value in zip(columns, result.stdout.split()):
+                column.append(float(value))
+    return [statistics.median(column) for column in columns]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=7, help="Samples per measurement")
+    parser.add_argument(
+        "--selenium",
+        action="store_true",
+        help="Also time use_selenium=True and the first driver launch",
+    )
+    args = parser.parse_args()
+
+    print(f"main.py --help:             {time_cli(args.runs) * 1000:8.1f} ms")
+
+    imported, constructed, _ = time_construction(args.runs, False, False)
+    print(f"import main:                {imported * 1000:8.1f} ms")
+    print(f"AliExpressScraper():        {constructed * 1000:8.1f} ms")
+
+    if args.selenium:
+        _, constructed, launched = time_construction(args.runs, True, True)
+        print(f"AliExpressScraper(selenium): {constructed * 1000:7.1f} ms")
+        print(f"first driver access:        {launched * 1000:8.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
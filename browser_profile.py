@@ -0,0 +1,292 @@
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+
+log = logging.getLogger("aliexpress.browser")
+
+
+def _write_json(path, data):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def _pid_alive(pid):
+    if os.name == "nt":
+        # os.kill would terminate the process on Windows; assume it's alive
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class BrowserProfile:
+    """One persistent Chrome --user-data-dir checked out from the pool"""
+
+    def __init__(self, slot, path, meta_path, lock_path, meta):
+        self.slot = slot
+        self.path = path
+        self.meta_path = meta_path
+        self.lock_path = lock_path
+        self.meta = meta
+
+    @property
+    def warm(self):
+        return self.meta.get("uses", 0) > 0
+
+    @property
+    def flagged(self):
+        return self.meta.get("flagged", False)
+
+
+class BrowserProfilePool:
+    """Persistent Chrome profiles, one per pool slot
+
+    Each slot is a user-data-dir under ``root`` that is reused across runs so
+    cookies, local storage and consent/locale choices survive. A slot is
+    locked while a browser uses it (Chrome can't share a profile between two
+    instances). Profiles older than ``max_age`` seconds, with a corrupt
+    "Local State", or flagged ``max_flags`` times (captchas) are wiped and
+    start over the next time the slot is checked out.
+    """
+
+    def __init__(self, root, slots=1, max_age=7 * 86400, max_flags=3):
+        self.root = root
+        self.slots = slots
+        self.max_age = max_age
+        self.max_flags = max_flags
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+
+    def _paths(self, slot):
+        base = os.path.join(self.root, f"slot-{slot}")
+        return base, f"{base}.json", f"{base}.lock"
+
+    def _try_lock(self, lock_path):
+        try:
+            fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            try:
+                with open(lock_path, "r", encoding="utf-8") as f:
+                    pid = int(f.read().strip() or 0)
+            except (OSError, ValueError):
+                pid = 0
+            if pid and _pid_alive(pid):
+                return False
+            # Left behind by a crashed run
+            log.info("Removing stale profile lock %s", lock_path)
+            try:
+                os.remove(lock_path)
+            except FileNotFoundError:
+                pass
+            return self._try_lock(lock_path)
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(str(os.getpid()))
+        return True
+
+    def _load_meta(self, meta_path):
+        try:
+            with open(meta_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _stale_reason(self, path, meta):
+        if meta is None:
+            return "no metadata" if os.path.isdir(path) else None
+        if time.time() - meta.get("created", 0) > self.max_age:
+            return "expired"
+        if meta.get("flags", 0) >= self.max_flags:
+            return "flagged"
+        local_state = os.path.join(path, "Local State")
+        if os.path.exists(local_state):
+            try:
+                with open(local_state, "r", encoding="utf-8") as f:
+                    json.load(f)
+            except (OSError, ValueError):
+                return "corrupt Local State"
+        return None
+
+    def acquire(self):
+        """Check out a free slot, rotating it first if it went stale
+
+        Returns None when every slot is in use; the caller should fall back
+        to a throwaway profile.
+        """
+        with self._lock:
+            for slot in range(self.slots):
+                path, meta_path, lock_path = self._paths(slot)
+                if not self._try_lock(lock_path):
+                    continue
+
+                meta = self._load_meta(meta_path)
+                reason = self._stale_reason(path, meta)
+                if reason:
+                    log.info("Rotating browser profile slot %d (%s)", slot, reason)
+                    shutil.rmtree(path, ignore_errors=True)
+                    meta = None
+                if meta is None:
+                    meta = {"created": time.time(), "uses": 0, "flags": 0}
+                os.makedirs(path, exist_ok=True)
+                meta.pop("flagged", None)
+                meta["last_used"] = time.time()
+                _write_json(meta_path, meta)
+
+                profile = BrowserProfile(slot, path, meta_path, lock_path, meta)
+                log.info(
+                    "Using %s browser profile slot %d",
+                    "warm" if profile.warm else "fresh",
+                    slot,
+                )
+                return profile
+        log.warning("All %d browser profile slots are busy", self.slots)
+        return None
+
+    def flag(self, profile):
+        """Record that the site challenged this profile (e.g. a captcha)"""
+        with self._lock:
+            profile.meta["flags"] = profile.meta.get("flags", 0) + 1
+            profile.meta["flagged"] = True
+            _write_json(profile.meta_path, profile.meta)
+
+    def release(self, profile, ok=True):
+        """Return a slot; a clean session resets the flag count"""
+        with self._lock:
+            profile.meta["uses"] = profile.meta.get("uses", 0) + 1
+            profile.meta["last_used"] = time.time()
+            if ok and not profile.meta.get("flagged"):
+                profile.meta["flags"] = 0
+            profile.meta.pop("flagged", None)
+            _write_json(profile.meta_path, profile.meta)
+            try:
+                os.remove(profile.lock_path)
+            except FileNotFoundError:
+                pass
+
+
+class CookieJar:
+    """Cookies shared between the browser and the requests session
+
+    Stored as a JSON list in Chrome DevTools format (name, value, domain,
+    path, expires, secure, httpOnly) so they can be pushed into a fresh
+    browser with Network.setCookies without visiting the site first.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._cookies = {}
+        self._lock = threading.Lock()
+        self.load()
+
+    @staticmethod
+    def _key(cookie):
+        return cookie.get("domain", ""), cookie.get("path", "/"), cookie["name"]
+
+    @staticmethod
+    def _expired(cookie, now):
+        expires = cookie.get("expires", -1)
+        return expires is not None and 0 < expires < now
+
+    def __len__(self):
+        return len(self._cookies)
+
+    def load(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                cookies = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            log.warning("Ignoring unreadable cookie jar %s: %s", self.path, e)
+            return
+        self.update(cookies)
+
+    def save(self):
+        with self._lock:
+            now = time.time()
+            cookies = [c for c in self._cookies.values() if not self._expired(c, now)]
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        _write_json(self.path, cookies)
+        log.info("Saved %d cookies to %s", len(cookies), self.path)
+
+    def cookies(self):
+        with self._lock:
+            now = time.time()
+            return [c for c in self._cookies.values() if not self._expired(c, now)]
+
+    def update(self, cookies):
+        with self._lock:
+            for cookie in cookies:
+                if cookie.get("name"):
+                    self._cookies[self._key(cookie)] = cookie
+
+    def clear(self):
+        with self._lock:
+            self._cookies = {}
+
+    # Browser side
+
+    def apply_to_driver(self, driver):
+        cookies = []
+        for c in self.cookies():
+            c = dict(c)
+            if not c.get("expires") or c["expires"] <= 0:
+                # Session cookie; CDP wants the field left out
+                c.pop("expires", None)
+            cookies.append(c)
+        if cookies:
+            driver.execute_cdp_cmd("Network.setCookies", {"cookies": cookies})
+
+    def update_from_driver(self, driver):
+        result = driver.execute_cdp_cmd("Network.getAllCookies", {})
+        self.update(
+            {
+                "name": c["name"],
+                "value": c["value"],
+                "domain": c["domain"],
+                "path": c.get("path", "/"),
+                "expires": c.get("expires", -1),
+                "secure": c.get("secure", False),
+                "httpOnly": c.get("httpOnly", False),
+            }
+            for c in result.get("cookies", [])
+        )
+
+    # requests side
+
+    def apply_to_session(self, session):
+        for c in self.cookies():
+            expires = c.get("expires", -1)
+            session.cookies.set(
+                c["name"],
+                c["value"],
+                domain=c.get("domain", ""),
+                path=c.get("path", "/"),
+                secure=c.get("secure", False),
+                expires=int(expires) if expires and expires > 0 else None,
+                rest={"HttpOnly": None} if c.get("httpOnly") else {},
+            )
+
+    def update_from_session(self, session):
+        self.update(
+            {
+                "name": c.name,
+                "value": c.value,
+                "domain": c.domain,
+                "path": c.path,
+                "expires": c.expires if c.expires else -1,
+                "secure": c.secure,
+                "httpOnly": c.has_nonstandard_attr("HttpOnly"),
+            }
+            for c in session.cookies
+        )
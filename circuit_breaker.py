@@ -0,0 +1,196 @@
+import heapq
+import itertools
+import logging
+import threading
+import time
+
+log = logging.getLogger("aliexpress.scraper")
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    """Captcha circuit for one host/proxy/session
+
+    Each captcha hit counts against the circuit; once ``threshold`` hits land
+    inside ``window`` seconds the circuit opens for ``cooldown`` seconds.
+    After the cool-down a single probe request is let through (half-open):
+    success closes the circuit, another captcha re-opens it with the
+    cool-down doubled up to ``max_cooldown``.
+    """
+
+    def __init__(self, key, threshold=1, window=300, cooldown=120, max_cooldown=1800):
+        self.key = key
+        self.threshold = threshold
+        self.window = window
+        self.base_cooldown = cooldown
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.state = CLOSED
+        self.opened_until = 0.0
+        self.hits = []
+        self.total_captchas = 0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """Return True if a request may be sent through this circuit now"""
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN and time.monotonic() >= self.opened_until:
+                self.state = HALF_OPEN
+                self._probe_in_flight = False
+            if self.state == HALF_OPEN and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            if self.state != CLOSED:
+                log.info("Circuit %s closed", self.key)
+            self.state = CLOSED
+            self.cooldown = self.base_cooldown
+            self.hits = []
+            self._probe_in_flight = False
+
+    def record_captcha(self):
+        with self._lock:
+            now = time.monotonic()
+            self.total_captchas += 1
+            self.hits = [t for t in self.hits if now - t < self.window]
+            self.hits.append(now)
+
+            if self.state == HALF_OPEN:
+                # Probe failed, back off harder
+                self.cooldown = min(self.cooldown * 2, self.max_cooldown)
+            elif len(self.hits) < self.threshold:
+                return
+
+            self.state = OPEN
+            self.opened_until = now + self.cooldown
+            self._probe_in_flight = False
+            log.warning(
+                "Circuit %s opened for %ds after captcha",
+                self.key,
+                self.cooldown,
+                extra={"stage": "captcha"},
+            )
+
+    def record_failure(self):
+        """A request allow() let through failed without a verdict (network error etc.)
+
+        A half-open probe that errors re-opens the circuit for another
+        cool-down; otherwise the probe slot would stay taken for good.
+        """
+        with self._lock:
+            if self.state != HALF_OPEN:
+                return
+            self.state = OPEN
+            self.opened_until = time.monotonic() + self.cooldown
+            self._probe_in_flight = False
+
+    def accepting(self):
+        """What parked work may go now: CLOSED (all), HALF_OPEN (one probe) or None"""
+        with self._lock:
+            if self.state == CLOSED:
+                return CLOSED
+            if self.state == OPEN and time.monotonic() < self.opened_until:
+                return None
+            if self.state == HALF_OPEN and self._probe_in_flight:
+                return None
+            return HALF_OPEN
+
+    def remaining(self):
+        """Seconds until the circuit will let a probe through"""
+        with self._lock:
+            if self.state != OPEN:
+                return 0.0
+            return max(0.0, self.opened_until - time.monotonic())
+
+
+class CircuitBreakerRegistry:
+    """Per-key circuit breakers plus the work parked while they are open
+
+    Parked work comes back one probe at a time: once a circuit cools down a
+    single item is released to probe it, and the rest stay parked until the
+    probe has closed the circuit (checked every ``recheck`` seconds).
+    """
+
+    def __init__(self, recheck=1.0, **breaker_options):
+        self.breaker_options = breaker_options
+        self.recheck = recheck
+        self._breakers = {}
+        self._parked = []
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def get(self, key):
+        with self._lock:
+            breaker = self._breakers.get(key)
+            if breaker is None:
+                breaker = CircuitBreaker(key, **self.breaker_options)
+                self._breakers[key] = breaker
+            return breaker
+
+    def allow(self, key):
+        allowed = self.get(key).allow()
+        self._local.denied = not allowed
+        return allowed
+
+    def clear_denied(self):
+        self._local.denied = False
+
+    def denied(self):
+        """True if this thread's last allow() was refused, i.e. the work never ran"""
+        return getattr(self._local, "denied", False)
+
+    def is_open(self, key):
+        return self.get(key).remaining() > 0
+
+    def park(self, key, kind, payload, attempts=0):
+        """Set work aside until the circuit for ``key`` lets requests through"""
+        ready_at = time.monotonic() + self.get(key).remaining()
+        with self._lock:
+            heapq.heappush(
+                self._parked, (ready_at, next(self._counter), key, kind, payload, attempts)
+            )
+
+    def pop_ready(self):
+        """Remove and return parked work its circuit will let through now"""
+        now = time.monotonic()
+        ready = []
+        held = []
+        probes = set()
+        with self._lock:
+            while self._parked and self._parked[0][0] <= now:
+                item = heapq.heappop(self._parked)
+                key = item[2]
+                breaker = self._breakers.get(key)
+                state = breaker.accepting() if breaker is not None else CLOSED
+                if state == CLOSED or (state == HALF_OPEN and key not in probes):
+                    if state == HALF_OPEN:
+                        probes.add(key)
+                    ready.append(item[2:])
+                else:
+                    held.append((breaker, item))
+            for breaker, (_, order, key, kind, payload, attempts) in held:
+                # Still open, or probing: wait for the cool-down / the verdict
+                ready_at = now + max(breaker.remaining(), self.recheck)
+                heapq.heappush(self._parked, (ready_at, order, key, kind, payload, attempts))
+        return ready
+
+    def next_ready_in(self):
+        """Seconds until the next parked item is due (None if nothing is parked)"""
+        with self._lock:
+            if not self._parked:
+                return None
+            return max(0.0, self._parked[0][0] - time.monotonic())
+
+    def parked_count(self):
+        with self._lock:
+            return len(self._parked)
@@ -0,0 +1,226 @@
+import logging
+import math
+import re
+import threading
+import time
+from collections import OrderedDict, deque
+from datetime import datetime, timedelta
+
+log = logging.getLogger("aliexpress.crawl")
+
+DURATION_PATTERN = re.compile(r"^\s*(\d+(?:\.\d+)?)\s*([hms]?)\s*$")
+
+
+def parse_deadline(text, now=None):
+    """Seconds from now until a deadline given as "4h", "90m", "300s" or "06:30"
+
+    A clock time that has already passed today means tomorrow.
+    """
+    match = DURATION_PATTERN.match(text)
+    if match:
+        value, unit = float(match.group(1)), match.group(2) or "h"
+        return value * {"h": 3600, "m": 60, "s": 1}[unit]
+    now = now or datetime.now()
+    try:
+        clock = datetime.strptime(text.strip(), "%H:%M").time()
+    except ValueError:
+        raise ValueError(f"Bad deadline {text!r}; expected e.g. 4h, 90m or 06:30")
+    target = datetime.combine(now.date(), clock)
+    if target <= now:
+        target += timedelta(days=1)
+    return (target - now).total_seconds()
+
+
+def parse_weights(specs):
+    """{category: weight} from "NAME=WEIGHT" strings"""
+    weights = {}
+    for spec in specs or []:
+        name, sep, weight = spec.rpartition("=")
+        if not sep or not name.strip():
+            raise ValueError(f"Bad category weight {spec!r}; expected NAME=WEIGHT")
+        weights[name.strip()] = float(weight)
+    return weights
+
+
+def job_category(kind, payload):
+    """Category a listing job belongs to: the taxonomy name or category id"""
+    return str(payload[0])
+
+
+def product_category(product_data):
+    return str(product_data.get("category", product_data.get("category_id", "")))
+
+
+class CrawlScheduler:
+    """Hands out listing jobs across categories to fit a product budget and deadline
+
+    Categories are served fair-share: the next job always comes from the
+    category with the fewest products assigned relative to its weight, so
+    every category gets its share early instead of the taxonomy being
+    crawled in order. Each job's product count is the category's remaining
+    share spread over its remaining jobs. Once a deadline is set and some
+    products are in, the share is sized to what the measured throughput can
+    still deliver before the deadline, and concurrency() says how many
+    detail workers that takes.
+    """
+
+    def __init__(
+        self,
+        jobs,
+        budget,
+        deadline=None,
+        weights=None,
+        min_count=1,
+        max_count=60,
+        warmup=120,
+        clock=time.monotonic,
+    ):
+        self.budget = budget
+        self.min_count = min_count
+        self.max_count = max_count
+        self.warmup = warmup
+        self.clock = clock
+        self.started = clock()
+        self.deadline = self.started + deadline if deadline else None
+        self._lock = threading.Lock()
+
+        self.queues = OrderedDict()
+        for kind, payload in jobs:
+            self.queues.setdefault(job_category(kind, payload), deque()).append(
+                (kind, payload)
+            )
+        weights = weights or {}
+        for category in set(weights) - set(self.queues):
+            log.warning("No listing jobs for weighted category %r", category)
+        self.weights = {
+            category: max(weights.get(category, 1.0), 0.0) for category in self.queues
+        }
+        self.assigned = {category: 0 for category in self.queues}
+        self.saved = {category: 0 for category in self.queues}
+        self.first_job = {}
+        self.saved_total = 0
+        self._concurrency = None
+
+    # Progress
+
+    def record(self, product_data):
+        """A product was saved"""
+        category = product_category(product_data)
+        with self._lock:
+            self.saved_total += 1
+            if category in self.saved:
+                self.saved[category] += 1
+
+    def elapsed(self):
+        return self.clock() - self.started
+
+    def remaining_time(self):
+        if self.deadline is None:
+            return None
+        return max(0.0, self.deadline - self.clock())
+
+    def expired(self):
+        return self.deadline is not None and self.clock() >= self.deadline
+
+    def rate(self):
+        """Products saved per second so far, None during warm-up"""
+        elapsed = self.elapsed()
+        if elapsed < self.warmup or not self.saved_total:
+            return None
+        return self.saved_total / elapsed
+
+    def category_rate(self, category):
+        """Products per second since the category's first job started"""
+        started = self.first_job.get(category)
+        if started is None:
+            return None
+        elapsed = self.clock() - started
+        return self.saved[category] / elapsed if elapsed > 0 else None
+
+    def target(self):
+        """Products this crawl can still be expected to reach"""
+        rate = self.rate()
+        remaining = self.remaining_time()
+        if rate is None or remaining is None:
+            return self.budget
+        return min(self.budget, self.saved_total + int(rate * remaining))
+
+    # Allocation
+
+    def _share(self, category):
+        total_weight = sum(self.weights.values()) or 1.0
+        return self.target() * self.weights[category] / total_weight
+
+    def _next_category(self):
+        pending = [c for c, queue in self.queues.items() if queue and self.weights[c]]
+        if not pending:
+            return None
+        # Fewest products assigned per unit of weight goes next
+        return min(pending, key=lambda c: self.assigned[c] / self.weights[c])
+
+    def _job_count(self, category):
+        left = self._share(category) - max(self.assigned[category], self.saved[category])
+        per_job = math.ceil(left / len(self.queues[category])) if left > 0 else 0
+        return max(self.min_count, min(self.max_count, per_job))
+
+    def next_job(self):
+        """Next (kind, payload) with its count set, or None when done"""
+        with self._lock:
+            if self.expired() or self.saved_total >= self.budget:
+                return None
+            category = self._next_category()
+            if category is None:
+                return None
+            kind, payload = self.queues[category].popleft()
+            count = self._job_count(category)
+            self.assigned[category] += count
+            self.first_job.setdefault(category, self.clock())
+        # The last payload field is the job's product count / items per page
+        return kind, tuple(payload[:-1]) + (count,)
+
+    def jobs(self):
+        """Generator of jobs, allocated as they are pulled"""
+        while True:
+            job = self.next_job()
+            if job is None:
+                return
+            yield job
+
+    def concurrency(self, current, max_workers, min_workers=1):
+        """Detail workers needed to reach the budget by the deadline
+
+        ``current`` is how many run now; it is kept until there is a
+        deadline and a measured rate to size against.
+        """
+        rate = self.rate()
+        remaining = self.remaining_time()
+        self._concurrency = current
+        if rate is None or remaining is None or remaining <= 0:
+            return current
+        needed_rate = max(0, self.budget - self.saved_total) / remaining
+        per_worker = rate / current
+        workers = math.ceil(needed_rate / per_worker) if per_worker else max_workers
+        self._concurrency = max(min_workers, min(max_workers, workers))
+        return self._concurrency
+
+    def status(self):
+        with self._lock:
+            categories = [
+                {
+                    "category": category,
+                    "saved": self.saved[category],
+                    "assigned": self.assigned[category],
+                    "jobs_left": len(queue),
+                    "rate_per_min": round((self.category_rate(category) or 0) * 60, 2),
+                }
+                for category, queue in self.queues.items()
+            ]
+        remaining = self.remaining_time()
+        return {
+            "saved": self.saved_total,
+            "budget": self.budget,
+            "target": self.target(),
+            "remaining_s": round(remaining) if remaining is not None else None,
+            "concurrency": self._concurrency,
+            "categories": categories,
+        }
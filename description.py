@@ -0,0 +1,84 @@
+import gzip
+import os
+import re
+from html.parser import HTMLParser
+
+DESCRIPTION_FILE = "description.html.gz"
+DESCRIPTION_URL_PATTERN = re.compile(r'"descriptionUrl"\s*:\s*"([^"]+)"')
+
+
+def description_url(state=None, html=None):
+    """URL the page loads its description from, or None
+
+    Looks in the embedded page state first and falls back to a plain search
+    of the page source.
+    """
+    if isinstance(state, dict):
+        data = state.get("data") if isinstance(state.get("data"), dict) else state
+        for module in ("descriptionModule", "productDescComponent"):
+            url = (data.get(module) or {}).get("descriptionUrl")
+            if url:
+                return _absolute(url)
+    if html:
+        match = DESCRIPTION_URL_PATTERN.search(html)
+        if match:
+            return _absolute(match.group(1).replace("\\/", "/"))
+    return None
+
+
+def _absolute(url):
+    return "https:" + url if url.startswith("//") else url
+
+
+class _TextExtractor(HTMLParser):
+    """Collects visible text, one line per block element"""
+
+    BLOCKS = {"p", "div", "br", "li", "tr", "h1", "h2", "h3", "h4", "h5", "h6"}
+
+    def __init__(self):
+        super().__init__()
+        self.parts = []
+        self._skip = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in ("script", "style"):
+            self._skip += 1
+        elif tag in self.BLOCKS:
+            self.parts.append("\n")
+
+    def handle_endtag(self, tag):
+        if tag in ("script", "style") and self._skip:
+            self._skip -= 1
+
+    def handle_data(self, data):
+        if not self._skip:
+            self.parts.append(data)
+
+
+def description_text(html):
+    """Plain text of a description document"""
+    parser = _TextExtractor()
+    parser.feed(html)
+    parser.close()
+    lines = (" ".join(line.split()) for line in "".join(parser.parts).splitlines())
+    return "\n".join(line for line in lines if line)
+
+
+def description_summary(text, limit=300):
+    """The start of a description's text, cut at a word, for the product record"""
+    text = " ".join(text.split())
+    if len(text) <= limit:
+        return text
+    return text[:limit].rsplit(" ", 1)[0] + "…"
+
+
+def save_description(folder, html):
+    """Write the description HTML gzip-compressed; returns the file name"""
+    with gzip.open(os.path.join(folder, DESCRIPTION_FILE), "wt", encoding="utf-8") as f:
+        f.write(html)
+    return DESCRIPTION_FILE
+
+
+def load_description(folder):
+    with gzip.open(os.path.join(folder, DESCRIPTION_FILE), "rt", encoding="utf-8") as f:
+        return f.read()
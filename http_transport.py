@@ -0,0 +1,295 @@
+import logging
+import socket
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import urlparse
+
+log = logging.getLogger("aliexpress.http")
+
+
+class DnsCache:
+    """TTL cache of resolved addresses for one transport's connections
+
+    urllib3 resolves the host for every new connection; the image CDN and
+    the site resolve to the same few addresses all run, so answers are
+    kept for ``ttl`` seconds. At most ``max_entries`` hosts are kept, the
+    least recently used going first. Nothing outside the transport's own
+    connection pools goes through it.
+    """
+
+    def __init__(self, ttl=300, max_entries=256):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def resolve(self, host, port):
+        """The addresses to try for host:port, in resolver order"""
+        key = (host, port)
+        now = time.monotonic()
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached is not None and cached[0] > now:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return cached[1]
+        infos = socket.getaddrinfo(host, port, 0, socket.SOCK_STREAM)
+        addresses = list(dict.fromkeys(info[4][0] for info in infos))
+        with self._lock:
+            self.misses += 1
+            self._cache[key] = (now + self.ttl, addresses)
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+        return addresses
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+
+def _connect_cached(connection, new_conn, dns_cache):
+    """urllib3 _new_conn through the cache: each cached address in turn"""
+    host = connection._dns_host
+    try:
+        addresses = dns_cache.resolve(host, connection.port)
+    except OSError:
+        # Let urllib3 resolve it and report the failure its own way
+        return new_conn()
+    error = None
+    for address in addresses:
+        # _dns_host only picks the address; SNI and Host still use the name
+        connection._dns_host = address
+        try:
+            return new_conn()
+        except Exception as e:
+            error = e
+        finally:
+            connection._dns_host = host
+    if error is None:
+        return new_conn()
+    raise error
+
+
+def dns_cached_adapter(dns_cache, **options):
+    """A requests HTTPAdapter whose new connections resolve through ``dns_cache``"""
+    from requests.adapters import HTTPAdapter
+    from urllib3.connection import HTTPConnection, HTTPSConnection
+    from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+    class CachedHTTPConnection(HTTPConnection):
+        def _new_conn(self):
+            return _connect_cached(self, super()._new_conn, dns_cache)
+
+    class CachedHTTPSConnection(HTTPSConnection):
+        def _new_conn(self):
+            return _connect_cached(self, super()._new_conn, dns_cache)
+
+    class CachedHTTPConnectionPool(HTTPConnectionPool):
+        ConnectionCls = CachedHTTPConnection
+
+    class CachedHTTPSConnectionPool(HTTPSConnectionPool):
+        ConnectionCls = CachedHTTPSConnection
+
+    pool_classes = {
+        "http": CachedHTTPConnectionPool,
+        "https": CachedHTTPSConnectionPool,
+    }
+
+    class DnsCachedAdapter(HTTPAdapter):
+        def init_poolmanager(self, *args, **kwargs):
+            super().init_poolmanager(*args, **kwargs)
+            self.poolmanager.pool_classes_by_scheme = pool_classes
+
+        def proxy_manager_for(self, proxy, **proxy_kwargs):
+            manager = super().proxy_manager_for(proxy, **proxy_kwargs)
+            manager.pool_classes_by_scheme = pool_classes
+            return manager
+
+    return DnsCachedAdapter(**options)
+
+
+class HttpTransport:
+    """Shared connection pools for every non-browser request
+
+    One requests session (keep-alive pools sized by ``pool_size``) backs
+    search, detail, description and image fetches. At most ``per_host``
+    requests run against one host at a time, which also bounds its pool.
+    With http2=True and httpx (with h2) installed, requests are multiplexed
+    over HTTP/2 instead; the session's cookie jar is shared with it.
+    ``dns_ttl`` turns on a DNS cache for the session's own pools (HTTP/1.1
+    only); by default every new connection resolves normally.
+    """
+
+    def __init__(
+        self,
+        headers=None,
+        cookie_jar=None,
+        pool_size=10,
+        per_host=6,
+        http2=False,
+        dns_ttl=None,
+        metrics=None,
+    ):
+        self.headers = dict(headers or {})
+        self.cookie_jar = cookie_jar
+        self.metrics = metrics
+        self.pool_size = max(pool_size, per_host)
+        self.per_host = per_host
+        self.http2 = http2
+        self.dns_cache = DnsCache(dns_ttl) if dns_ttl else None
+        self._session = None
+        self._h2_clients = {}
+        self._host_slots = {}
+        self._requests = {}
+        self._h2_requests = 0
+        self._lock = threading.Lock()
+
+        if self.http2 and not self._httpx_available():
+            log.warning("HTTP/2 needs httpx with h2 installed; using HTTP/1.1")
+            self.http2 = False
+
+    @staticmethod
+    def _httpx_available():
+        try:
+            import h2  # noqa: F401
+            import httpx  # noqa: F401
+        except ImportError:
+            return False
+        return True
+
+    @property
+    def session(self):
+        """requests session holding the shared pools and cookies"""
+        with self._lock:
+            if self._session is None:
+                import requests
+                from requests.adapters import HTTPAdapter
+
+                session = requests.Session()
+                session.headers.update(self.headers)
+                options = {
+                    "pool_connections": self.pool_size,
+                    "pool_maxsize": self.pool_size,
+                }
+                if self.dns_cache is not None:
+                    adapter = dns_cached_adapter(self.dns_cache, **options)
+                else:
+                    adapter = HTTPAdapter(**options)
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                if self.cookie_jar is not None:
+                    self.cookie_jar.apply_to_session(session)
+                self._session = session
+            return self._session
+
+    @property
+    def started(self):
+        """Whether any request (or session access) has happened yet"""
+        return self._session is not None
+
+    def _h2_client(self, proxy):
+        with self._lock:
+            client = self._h2_clients.get(proxy)
+            if client is None:
+                import httpx
+
+                options = {
+                    "http2": True,
+                    "headers": self.headers,
+                    # Same jar object as the session, so cookies stay shared
+                    "cookies": self._session.cookies,
+                    "limits": httpx.Limits(
+                        max_connections=self.pool_size,
+                        max_keepalive_connections=self.pool_size,
+                    ),
+                }
+                try:
+                    client = httpx.Client(proxy=proxy, **options)
+                except TypeError:
+                    # httpx < 0.26 only knows "proxies"
+                    client = httpx.Client(proxies=proxy, **options)
+                self._h2_clients[proxy] = client
+            return client
+
+    def _slot(self, host):
+        with self._lock:
+            slot = self._host_slots.get(host)
+            if slot is None:
+                slot = self._host_slots[host] = threading.BoundedSemaphore(
+                    self.per_host
+                )
+            return slot
+
+    def request(self, method, url, proxies=None, **kwargs):
+        """Send a request through the shared pools (requests-style arguments)"""
+        session = self.session
+        host = urlparse(url).hostname or ""
+        with self._slot(host):
+            if self.http2:
+                proxy = (proxies or {}).get(urlparse(url).scheme)
+                client = self._h2_client(proxy)
+                follow = kwargs.pop("allow_redirects", True)
+                response = client.request(
+                    method, url, follow_redirects=follow, **kwargs
+                )
+            else:
+                response = session.request(method, url, proxies=proxies, **kwargs)
+        with self._lock:
+            self._requests[host] = self._requests.get(host, 0) + 1
+            if getattr(response, "http_version", None) == "HTTP/2":
+                self._h2_requests += 1
+        if self.metrics is not None:
+            self.metrics.inc("http_requests_total", host=host)
+        return response
+
+    def _connections(self):
+        """New connections opened so far per host (HTTP/1.1 pools only)"""
+        counts = {}
+        if self._session is None:
+            return counts
+        for adapter in set(self._session.adapters.values()):
+            managers = [adapter.poolmanager] + list(adapter.proxy_manager.values())
+            for manager in managers:
+                for key in list(manager.pools.keys()):
+                    pool = manager.pools.get(key)
+                    if pool is not None:
+                        host = pool.host
+                        counts[host] = counts.get(host, 0) + pool.num_connections
+        return counts
+
+    def stats(self):
+        """Per-host requests, connections opened and reuse ratio"""
+        with self._lock:
+            requests_by_host = dict(self._requests)
+            h2_requests = self._h2_requests
+        connections = self._connections()
+        hosts = []
+        for host, count in sorted(requests_by_host.items()):
+            opened = connections.get(host)
+            hosts.append(
+                {
+                    "host": host,
+                    "requests": count,
+                    "connections": opened,
+                    "reuse": round(1 - opened / count, 3) if opened else None,
+                }
+            )
+        stats = {"hosts": hosts, "http2_requests": h2_requests}
+        if self.dns_cache is not None:
+            stats["dns_hits"] = self.dns_cache.hits
+            stats["dns_misses"] = self.dns_cache.misses
+        return stats
+
+    def close(self):
+        for client in self._h2_clients.values():
+            client.close()
+        self._h2_clients = {}
+        if self._session is not None:
+            self._session.close()
+            self._session = None
+        if self.dns_cache is not None:
+            self.dns_cache.clear()
@@ -0,0 +1,278 @@
+import json
+import logging
+import os
+import struct
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+log = logging.getLogger("aliexpress.images")
+
+# File extension used for each sniffed format
+FORMAT_EXTENSIONS = {
+    "jpeg": ".jpg",
+    "png": ".png",
+    "gif": ".gif",
+    "webp": ".webp",
+    "avif": ".avif",
+    "heic": ".heic",
+}
+
+# Pillow save() format names for transcoding targets
+PIL_FORMATS = {"jpeg": "JPEG", "png": "PNG", "webp": "WEBP", "avif": "AVIF"}
+
+
+def sniff_format(header):
+    """Detect the real image format from the first bytes of a file"""
+    if header.startswith(b"\xff\xd8\xff"):
+        return "jpeg"
+    if header.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "png"
+    if header[:6] in (b"GIF87a", b"GIF89a"):
+        return "gif"
+    if header[:4] == b"RIFF" and header[8:12] == b"WEBP":
+        return "webp"
+    if header[4:8] == b"ftyp":
+        brand = header[8:12]
+        if brand in (b"avif", b"avis"):
+            return "avif"
+        if brand in (b"heic", b"heix", b"mif1", b"msf1"):
+            return "heic"
+    return None
+
+
+def image_dimensions(data, image_format):
+    """Read (width, height) from the image header without decoding pixels"""
+    try:
+        if image_format == "png":
+            return struct.unpack(">II", data[16:24])
+        if image_format == "gif":
+            return struct.unpack("<HH", data[6:10])
+        if image_format == "webp":
+            return _webp_dimensions(data)
+        if image_format == "jpeg":
+            return _jpeg_dimensions(data)
+        if image_format in ("avif", "heic"):
+            return _isobmff_dimensions(data)
+    except (struct.error, IndexError, ValueError):
+        pass
+    return None, None
+
+
+def _jpeg_dimensions(data):
+    i = 2
+    while i + 9 < len(data):
+        if data[i] != 0xFF:
+            i += 1
+            continue
+        marker = data[i + 1]
+        # SOF0..SOF15 except DHT (C4), JPG (C8) and DAC (CC)
+        if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            height, width = struct.unpack(">HH", data[i + 5 : i + 9])
+            return width, height
+        if marker in (0xD8, 0x01) or 0xD0 <= marker <= 0xD7:
+            i += 2
+            continue
+        (length,) = struct.unpack(">H", data[i + 2 : i + 4])
+        i += 2 + length
+    return None, None
+
+
+def _webp_dimensions(data):
+    chunk = data[12:16]
+    if chunk == b"VP8 ":
+        width, height = struct.unpack("<HH", data[26:30])
+        return width & 0x3FFF, height & 0x3FFF
+    if chunk == b"VP8L":
+        bits = int.from_bytes(data[21:25], "little")
+        return (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+    if chunk == b"VP8X":
+        width = int.from_bytes(data[24:27], "little") + 1
+        height = int.from_bytes(data[27:30], "little") + 1
+        return width, height
+    return None, None
+
+
+def _isobmff_dimensions(data):
+    # The 'ispe' property box holds the image spatial extents
+    i = data.find(b"ispe")
+    if i < 0:
+        return None, None
+    return struct.unpack(">II", data[i + 8 : i + 16])
+
+
+def process_image(path, target_format=None, quality=85, thumbnail_size=None):
+    """Fix the extension, optionally transcode and thumbnail one downloaded image
+
+    Runs inside a worker process, so it only takes and returns plain values.
+    Transcoding and thumbnails need Pillow; format sniffing and dimensions
+    are read from the file header and work without it.
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+
+    image_format = sniff_format(data[:32])
+    result = {
+        "original_file": os.path.basename(path),
+        "file": os.path.basename(path),
+        "format": image_format,
+        "width": None,
+        "height": None,
+        "bytes": len(data),
+    }
+    if image_format is None:
+        result["error"] = "unrecognized image format"
+        return result
+
+    result["width"], result["height"] = image_dimensions(data, image_format)
+
+    # Rename to the real extension so consumers don't have to sniff again
+    base, ext = os.path.splitext(path)
+    real_ext = FORMAT_EXTENSIONS[image_format]
+    if ext.lower() != real_ext and not (real_ext == ".jpg" and ext.lower() == ".jpeg"):
+        new_path = base + real_ext
+        os.replace(path, new_path)
+        path = new_path
+        result["file"] = os.path.basename(path)
+
+    if not target_format and not thumbnail_size:
+        return result
+
+    try:
+        from PIL import Image
+    except ImportError:
+        result["error"] = "Pillow is required for transcoding/thumbnails (pip install Pillow)"
+        return result
+
+    replaced = None
+    try:
+        with Image.open(path) as img:
+            img.load()
+            result["width"], result["height"] = img.size
+
+            if target_format and target_format != image_format:
+                out_path = base + FORMAT_EXTENSIONS[target_format]
+                _save_image(img, out_path, target_format, quality)
+                if out_path != path:
+                    replaced = path
+                path = out_path
+                result["file"] = os.path.basename(path)
+                result["format"] = target_format
+                result["bytes"] = os.path.getsize(path)
+
+            if thumbnail_size:
+                thumb = img.copy()
+                thumb.thumbnail((thumbnail_size, thumbnail_size))
+                thumb_format = target_format or (
+                    image_format if image_format in PIL_FORMATS else "jpeg"
+                )
+                thumb_path = f"{base}_thumb{FORMAT_EXTENSIONS[thumb_format]}"
+                _save_image(thumb, thumb_path, thumb_format, quality)
+                result["thumbnail"] = os.path.basename(thumb_path)
+        # Only once the source is closed: Windows can't delete an open file
+        if replaced:
+            os.remove(replaced)
+    except Exception as e:
+        result["error"] = f"{type(e).__name__}: {e}"
+
+    return result
+
+
+def _save_image(img, path, image_format, quality):
+    if image_format == "jpeg" and img.mode not in ("RGB", "L"):
+        img = img.convert("RGB")
+    img.save(path, PIL_FORMATS[image_format], quality=quality)
+
+
+class ImagePostProcessor:
+    """Runs process_image over a product's downloads in a process pool
+
+    Jobs are submitted right after the images are written and the results are
+    merged into the product's JSON file from a completion callback, so the
+    scraping loop never waits on decoding or encoding.
+    """
+
+    def __init__(self, workers=2, target_format=None, quality=85, thumbnail_size=None):
+        if target_format and target_format not in PIL_FORMATS:
+            raise ValueError(
+                f"Unsupported target format {target_format!r}, "
+                f"choose one of {sorted(PIL_FORMATS)}"
+            )
+        self.target_format = target_format
+        self.quality = quality
+        self.thumbnail_size = thumbnail_size
+        self._executor = ProcessPoolExecutor(max_workers=workers)
+        self._lock = threading.Lock()
+
+    def submit(self, json_path, image_paths, product_data=None, save=None):
+        """Queue post-processing for one product's images
+
+        Results are merged into the JSON file at ``json_path``, or, when
+        ``save`` is given, into ``product_data`` which is then passed to it
+        (e.g. ProductLog.append).
+        """
+        if not image_paths:
+            return []
+
+        pending = {"remaining": len(image_paths), "results": {}}
+
+        def on_done(future, key):
+            try:
+                result = future.result()
+            except Exception as e:
+                result = {"original_file": os.path.basename(key), "error": str(e)}
+            with self._lock:
+                pending["results"][key] = result
+                pending["remaining"] -= 1
+                if pending["remaining"] == 0:
+                    self._record_results(
+                        json_path, image_paths, pending["results"], product_data, save
+                    )
+
+        futures = []
+        for path in image_paths:
+            future = self._executor.submit(
+                process_image,
+                path,
+                self.target_format,
+                self.quality,
+                self.thumbnail_size,
+            )
+            future.add_done_callback(lambda f, key=path: on_done(f, key))
+            futures.append(future)
+        return futures
+
+    def _record_results(self, json_path, image_paths, results, product_data, save):
+        """Merge per-image info into product_data.json (or hand it to ``save``)"""
+        try:
+            if save is None:
+                with open(json_path, "r", encoding="utf-8") as f:
+                    product_data = json.load(f)
+
+            renamed = {}
+            image_info = []
+            for path in image_paths:
+                info = results[path]
+                info["folder"] = os.path.basename(os.path.dirname(path))
+                image_info.append(info)
+                if info.get("file"):
+                    renamed[info["original_file"]] = info["file"]
+
+            for key in ("main_image_files", "variant_image_files"):
+                product_data[key] = [
+                    renamed.get(name, name) for name in product_data.get(key, [])
+                ]
+            product_data["image_info"] = image_info
+
+            if save is not None:
+                save(product_data)
+                return
+            tmp_path = f"{json_path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(product_data, f, indent=4, ensure_ascii=False)
+            os.replace(tmp_path, json_path)
+        except Exception as e:
+            log.error("Error recording image info: %s", e, extra={"url": json_path})
+
+    def shutdown(self, wait=True):
+        """Finish outstanding jobs and stop the worker processes"""
+        self._executor.shutdown(wait=wait)
@@ -0,0 +1,124 @@
+import re
+import threading
+
+# AliExpress CDN resize suffixes: "<image>.jpg_640x640.jpg",
+# "<image>.jpg_800x800q90.jpg" or, for WebP, "<image>.jpg_800x800q90.jpg_.webp"
+SPEC_PATTERN = re.compile(
+    r"^(?:(?P<width>\d+)(?:x(?P<height>\d+))?)?(?:q(?P<quality>\d+))?"
+    r"(?:\.(?P<format>jpg|webp))?$"
+)
+ORIGINAL = "original"
+
+
+class ImageSizePolicy:
+    """Which CDN rendition of an image to download
+
+    Specs look like the CDN's own suffixes: "640" or "640x640" for a
+    bounding box, an optional "q90" for JPEG quality and an optional
+    ".webp" for WebP, e.g. "800x800q90.webp". "original" downloads the
+    full-size upload, as before.
+    """
+
+    def __init__(self, width=None, height=None, quality=None, format="jpg"):
+        self.width = width
+        self.height = height or width
+        self.quality = quality
+        self.format = format
+
+    @classmethod
+    def parse(cls, spec):
+        if spec is None or spec.strip().lower() in ("", ORIGINAL):
+            return cls()
+        match = SPEC_PATTERN.match(spec.strip().lower())
+        if not match or not (match["width"] or match["quality"]):
+            raise ValueError(
+                f"Bad image size {spec!r}; expected e.g. 640, 800x800q90 or "
+                "800x800q90.webp"
+            )
+        return cls(
+            width=int(match["width"]) if match["width"] else None,
+            height=int(match["height"]) if match["height"] else None,
+            quality=int(match["quality"]) if match["quality"] else None,
+            format=match["format"] or "jpg",
+        )
+
+    @property
+    def is_original(self):
+        return self.width is None and self.quality is None
+
+    @property
+    def extension(self):
+        return "webp" if self.format == "webp" and not self.is_original else "jpg"
+
+    def sized_url(self, url):
+        """CDN URL of this rendition, given a cleaned original image URL"""
+        if self.is_original or not url or "alicdn.com" not in url:
+            return url
+        suffix = ""
+        if self.width:
+            suffix += f"{self.width}x{self.height}"
+        if self.quality:
+            suffix += f"q{self.quality}"
+        sized = f"{url}_{suffix}.jpg"
+        if self.format == "webp":
+            sized += "_.webp"
+        return sized
+
+    def __str__(self):
+        if self.is_original:
+            return ORIGINAL
+        spec = f"{self.width}x{self.height}" if self.width else ""
+        spec += f"q{self.quality}" if self.quality else ""
+        return spec + (".webp" if self.format == "webp" else "")
+
+
+class ImageSavings:
+    """Run totals of bytes downloaded vs. what the originals would have cost
+
+    Only a sample of resized images has its original's size looked up; the
+    savings for the rest are extrapolated from the sampled size ratio.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.images = 0
+        self.sized = 0
+        self.fallbacks = 0
+        self.downloaded_bytes = 0
+        self.sized_bytes = 0
+        self.sampled = 0
+        self.sampled_bytes = 0
+        self.sampled_original_bytes = 0
+
+    def record(self, downloaded, original=None, sized=False, fallback=False):
+        """One image: bytes fetched and, if sampled, the original's size"""
+        with self._lock:
+            self.images += 1
+            self.sized += sized
+            self.fallbacks += fallback
+            self.downloaded_bytes += downloaded
+            if sized:
+                self.sized_bytes += downloaded
+            if original is not None:
+                self.sampled += 1
+                self.sampled_bytes += downloaded
+                self.sampled_original_bytes += original
+
+    @property
+    def saved_bytes(self):
+        """Estimated bytes the resized downloads avoided (None without samples)"""
+        if not self.sampled_bytes:
+            return None
+        ratio = self.sampled_original_bytes / self.sampled_bytes
+        return max(0, int(self.sized_bytes * (ratio - 1)))
+
+    def summary(self):
+        with self._lock:
+            return {
+                "images": self.images,
+                "sized": self.sized,
+                "fallbacks": self.fallbacks,
+                "downloaded_bytes": self.downloaded_bytes,
+                "sampled_originals": self.sampled,
+                "saved_bytes": self.saved_bytes,
+            }
@@ -0,0 +1,80 @@
+from sku_matrix import extract_embedded_state
+
+# Where search and category pages embed their result list
+LISTING_MARKERS = ("window._dida_config_._init_data_", "window.runParams")
+
+
+def find_item_list(data, depth=0):
+    """The list of result item dicts somewhere inside a page state object"""
+    if depth > 12:
+        return None
+    if isinstance(data, dict):
+        item_list = data.get("itemList")
+        if isinstance(item_list, dict) and isinstance(item_list.get("content"), list):
+            return item_list["content"]
+        values = data.values()
+    elif isinstance(data, list):
+        if data and all(isinstance(item, dict) and "productId" in item for item in data):
+            return data
+        values = data
+    else:
+        return None
+    for value in values:
+        if isinstance(value, (dict, list)):
+            items = find_item_list(value, depth + 1)
+            if items:
+                return items
+    return None
+
+
+def _text(value, *keys):
+    """First string found under the given keys of a nested dict"""
+    for key in keys:
+        if isinstance(value, dict):
+            value = value.get(key)
+    return value if isinstance(value, (str, int, float)) else None
+
+
+def card_from_item(item):
+    """Raw listing card from one embedded result item
+
+    Same shape as the in-page LISTING_CARDS_SCRIPT returns, so both go
+    through AliExpressScraper._listing_card.
+    """
+    item_id = str(item.get("productId") or item.get("itemId") or "")
+    if not item_id:
+        return None
+    prices = item.get("prices") or {}
+    price = _text(prices, "salePrice", "formattedPrice") or _text(
+        prices, "originalPrice", "formattedPrice"
+    )
+    title = _text(item, "title", "displayTitle") or _text(item, "title")
+    rating = _text(item, "evaluation", "starRating")
+    return {
+        "href": f"https://www.aliexpress.com/item/{item_id}.html",
+        "item_id": item_id,
+        "title": title,
+        "price": price,
+        "thumbnail": _text(item, "image", "imgUrl"),
+        "rating": str(rating) if rating is not None else None,
+    }
+
+
+def listing_cards_from_html(html):
+    """Raw cards for every result in a page's embedded state ([] if none)"""
+    items = find_item_list(extract_embedded_state(html, LISTING_MARKERS))
+    cards = []
+    for item in items or []:
+        card = card_from_item(item)
+        if card is not None:
+            cards.append(card)
+    return cards
+
+
+def listing_changed(previous, record):
+    """Whether a listing record differs from the last one seen for the item"""
+    if previous is None:
+        return True
+    return any(
+        previous.get(field) != record.get(field) for field in ("title", "price_value")
+    )
@@ -0,0 +1,583 @@
+"""Load test: run the HTTP-mode crawl against a local mock of the site
+
+Usage: python loadtest.py [--products N] [--rate-limit P] [--captcha P]
+                          [--slow P] [--reset P] [--throttle-start S
+                          --throttle-duration S] [--json]
+
+A threaded mock server answers search, product, description and image
+requests with synthetic pages shaped like the real ones (embedded result
+lists, product markup, CDN image paths). A share of them can be answered
+with a 429, a slow response, a captcha page (with the "unusual traffic"
+text the scraper looks for) or a connection reset. The scraper's shared
+transport is pointed at the mock by an adapter that rewrites every
+aliexpress/alicdn URL, so the crawl goes through the real pipeline, retry
+policy and captcha circuits.
+
+With --throttle-start/--throttle-duration the faults only apply inside
+that window, simulating a site that starts throttling mid-run; recovery
+time is how long after the window the product rate takes to get back to
+90% of its rate before it.
+
+Reports throughput, the faults injected, the scraper's retries, captchas
+and errors, recovery time and memory (RSS) growth over the run.
+"""
+
+import argparse
+import json
+import math
+import os
+import random
+import re
+import shutil
+import socket
+import struct
+import tempfile
+import threading
+import time
+import zlib
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit, urlunsplit
+
+CAPTCHA_PAGE = (
+    "<html><head><title>Verify</title></head><body>"
+    "<h1>Sorry, we have detected unusual traffic from your network.</h1>"
+    '<div id="nocaptcha">Please slide to verify</div></body></html>'
+)
+
+FAULT_KINDS = ("reset", "captcha", "rate_limit", "slow")
+
+ITEM_PATTERN = re.compile(r"/item/(\d+)\.html$")
+
+
+class FaultPlan:
+    """Share of requests answered with each fault, optionally only in a window
+
+    ``window`` is (start, end) in seconds since the run started. Captchas
+    are only served for pages, never for images.
+    """
+
+    def __init__(
+        self,
+        rate_limit=0.0,
+        captcha=0.0,
+        slow=0.0,
+        reset=0.0,
+        slow_delay=2.0,
+        retry_after=1,
+        window=None,
+        seed=None,
+    ):
+        self.rates = {
+            "reset": reset,
+            "captcha": captcha,
+            "rate_limit": rate_limit,
+            "slow": slow,
+        }
+        self.slow_delay = slow_delay
+        self.retry_after = retry_after
+        self.window = window
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def active(self, elapsed):
+        if self.window is None:
+            return True
+        start, end = self.window
+        return start <= elapsed < end
+
+    def pick(self, elapsed, page=True):
+        """Fault to inject for one request, or None"""
+        if not self.active(elapsed):
+            return None
+        with self._lock:
+            roll = self._random.random()
+        for kind in FAULT_KINDS:
+            rate = self.rates[kind]
+            if kind == "captcha" and not page:
+                continue
+            if roll < rate:
+                return kind
+            roll -= rate
+        return None
+
+
+class MockSite:
+    """Local HTTP server standing in for the search, item and CDN hosts"""
+
+    def __init__(
+        self,
+        faults,
+        items_per_page=60,
+        images_per_product=3,
+        image_bytes=4096,
+        latency=0.0,
+    ):
+        self.faults = faults
+        self.items_per_page = items_per_page
+        self.images_per_product = images_per_product
+        self.latency = latency
+        self.image = b"\xff\xd8\xff\xe0" + b"\0" * max(0, image_bytes - 4)
+        self.requests = Counter()
+        self.injected = Counter()
+        self.started = time.monotonic()
+        self._lock = threading.Lock()
+        self._thread = None
+
+        site = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                site.handle(self, head=False)
+
+            def do_HEAD(self):
+                site.handle(self, head=True)
+
+            def log_message(self, format, *args):
+                pass
+
+        class Server(ThreadingHTTPServer):
+            daemon_threads = True
+            request_queue_size = 256
+
+        self.server = Server(("127.0.0.1", 0), Handler)
+
+    @property
+    def address(self):
+        host, port = self.server.server_address[:2]
+        return f"{host}:{port}"
+
+    def start(self):
+        self.started = time.monotonic()
+        self._thread = threading.Thread(
+            target=self.server.serve_forever, name="mock-site", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+    # Pages
+
+    def item_id(self, term, page, index):
+        term = " ".join(term.lower().split())
+        return f"1005{zlib.crc32(term.encode()):010d}{page:02d}{index:02d}"
+
+    def search_page(self, term, page):
+        items = [
+            {
+                "productId": self.item_id(term, page, index),
+                "title": {"displayTitle": f"{term} result {page}-{index}"},
+                "prices": {
+                    "salePrice": {"formattedPrice": f"US ${1 + index % 50}.99"}
+                },
+                "image": {
+                    "imgUrl": f"//ae01.alicdn.com/kf/S{self.item_id(term, page, index)}"
+                    "n0.jpg_220x220.jpg"
+                },
+                "evaluation": {"starRating": 4.5},
+            }
+            for index in range(self.items_per_page)
+        ]
+        state = json.dumps({"data": {"root": {"itemList": {"content": items}}}})
+        return (
+            f"<html><head><title>{term}</title></head><body>"
+            f"<script>window.runParams = {state};</script></body></html>"
+        )
+
+    def product_page(self, item_id):
+        images = "".join(
+            f'<img src="//ae01.alicdn.com/kf/S{item_id}n{n}.jpg_640x640.jpg">'
+            for n in range(self.images_per_product)
+        )
+        state = json.dumps(
+            {
+                "data": {
+                    "descriptionModule": {
+                        "descriptionUrl": "//aeproductsourcesite.alicdn.com/product/"
+                        f"description/pc/v2/en_US/desc.htm?productId={item_id}"
+                    }
+                }
+            }
+        )
+        return (
+            f'<html><body><div data-product-id="{item_id}">'
+            f'<h1 class="product-title-text">Load test product {item_id}</h1>'
+            f'<div class="product-price-value">US ${int(item_id[-2:]) + 1}.99</div>'
+            f'<div class="image-gallery">{images}</div></div>'
+            f"<script>window.runParams = {state};</script></body></html>"
+        )
+
+    def description_page(self, item_id):
+        return (
+            f"<html><body><p>Description of {item_id}.</p>"
+            "<p>Material: cotton. Size: S-XL.</p></body></html>"
+        )
+
+    # Request handling
+
+    def route(self, path, query):
+        """(kind, content type, body) for a request path"""
+        if path.startswith("/wholesale"):
+            term = query.get("SearchText", [""])[0]
+            page = int(query.get("page", ["1"])[0])
+            return "search", "text/html", self.search_page(term, page).encode()
+        match = ITEM_PATTERN.search(path)
+        if match:
+            return "product", "text/html", self.product_page(match.group(1)).encode()
+        if path.startswith("/kf/"):
+            return "image", "image/jpeg", self.image
+        if path.startswith("/product/description"):
+            item_id = query.get("productId", [""])[0]
+            return "description", "text/html", self.description_page(item_id).encode()
+        return "other", "text/html", b"<html><body>Not found</body></html>"
+
+    def handle(self, handler, head):
+        parts = urlsplit(handler.path)
+        kind, content_type, body = self.route(parts.path, parse_qs(parts.query))
+        status = 404 if kind == "other" else 200
+        fault = self.faults.pick(
+            time.monotonic() - self.started, page=kind in ("search", "product")
+        )
+        with self._lock:
+            self.requests[kind] += 1
+            if fault:
+                self.injected[fault] += 1
+
+        if self.latency:
+            time.sleep(self.latency)
+        headers = {}
+        if fault == "reset":
+            # Close with SO_LINGER 0 so the client sees a reset, not a response
+            handler.connection.setsockopt(
+                socket.SOL_SOCKET, socket.SO_LINGER, struct.pack("ii", 1, 0)
+            )
+            handler.close_connection = True
+            return
+        if fault == "slow":
+            time.sleep(self.faults.slow_delay)
+        elif fault == "captcha":
+            content_type, body = "text/html", CAPTCHA_PAGE.encode()
+        elif fault == "rate_limit":
+            status, content_type = 429, "text/html"
+            body = b"<html><body>Too many requests</body></html>"
+            headers["Retry-After"] = str(self.faults.retry_after)
+
+        handler.send_response(status)
+        handler.send_header("Content-Type", content_type)
+        handler.send_header("Content-Length", str(len(body)))
+        for name, value in headers.items():
+            handler.send_header(name, value)
+        handler.end_headers()
+        if not head:
+            handler.wfile.write(body)
+
+
+def route_to_mock(session, address, pool_size):
+    """Send every request of a requests session to the mock site instead"""
+    from requests.adapters import HTTPAdapter
+
+    class MockRoute(HTTPAdapter):
+        def send(self, request, **kwargs):
+            parts = urlsplit(request.url)
+            request.url = urlunsplit(("http", address, parts.path, parts.query, ""))
+            return super().send(request, **kwargs)
+
+    adapter = MockRoute(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+
+
+def search_jobs(products, per_term):
+    """Enough synthetic search jobs to list ``products`` products"""
+    for n in range(math.ceil(products / per_term)):
+        yield "search", ("Load test", "loadtest", f"item{n}", per_term)
+
+
+def rss_bytes():
+    """Current resident set size (peak RSS where /proc is unavailable)"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        import resource
+
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class Monitor:
+    """Samples (seconds since start, products saved, RSS) once per interval"""
+
+    def __init__(self, pipeline, started, interval=1.0):
+        self.pipeline = pipeline
+        self.started = started
+        self.interval = interval
+        self.samples = []
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="monitor", daemon=True)
+
+    def _sample(self):
+        self.samples.append(
+            (time.monotonic() - self.started, self.pipeline.saved, rss_bytes())
+        )
+
+    def _run(self):
+        self._sample()
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self._sample()
+
+
+def rate_between(samples, start, end):
+    """Products per second between two points of the run"""
+    points = [sample for sample in samples if start <= sample[0] <= end]
+    if len(points) < 2 or points[-1][0] <= points[0][0]:
+        return None
+    return (points[-1][1] - points[0][1]) / (points[-1][0] - points[0][0])
+
+
+def recovery_time(samples, window_end, baseline, span=5.0, threshold=0.9):
+    """Seconds after window_end until a ``span`` window runs at 90% of baseline"""
+    if not baseline:
+        return None
+    for elapsed, _, _ in samples:
+        if elapsed < window_end + span:
+            continue
+        rate = rate_between(samples, elapsed - span, elapsed)
+        if rate is not None and rate >= threshold * baseline:
+            return elapsed - span - window_end
+    return None
+
+
+def memory_report(samples, products):
+    """RSS at the start, peak and end, and growth per 10k products
+
+    Growth is measured from the first sample past 10% of the products (or
+    1000 of them), after the pools, caches and imports have warmed up.
+    """
+    warm = min(1000, max(1, products // 10))
+    base = next((sample for sample in samples if sample[1] >= warm), samples[0])
+    end = samples[-1]
+    report = {
+        "rss_start_mb": round(samples[0][2] / 2**20, 1),
+        "rss_peak_mb": round(max(sample[2] for sample in samples) / 2**20, 1),
+        "rss_end_mb": round(end[2] / 2**20, 1),
+    }
+    if end[1] > base[1]:
+        growth = (end[2] - base[2]) / (end[1] - base[1]) * 10000
+        report["rss_growth_mb_per_10k"] = round(growth / 2**20, 2)
+    return report
+
+
+def run_load_test(args):
+    import asyncio
+
+    from circuit_breaker import CircuitBreakerRegistry
+    from http_transport import HttpTransport
+    from main import AliExpressScraper, is_transient_error
+    from metrics import Metrics
+    from pipeline import CrawlPipeline
+    from retry import RetryPolicy
+
+    window = None
+    if args.throttle_start is not None:
+        window = (args.throttle_start, args.throttle_start + args.throttle_duration)
+    faults = FaultPlan(
+        rate_limit=args.rate_limit,
+        captcha=args.captcha,
+        slow=args.slow,
+        reset=args.reset,
+        slow_delay=args.slow_delay,
+        retry_after=args.retry_after,
+        window=window,
+        seed=args.seed,
+    )
+    site = MockSite(
+        faults,
+        images_per_product=args.images_per_product,
+        image_bytes=args.image_bytes,
+        latency=args.latency / 1000,
+    )
+
+    output_dir = args.output or tempfile.mkdtemp(prefix="loadtest-")
+    metrics = Metrics()
+    transport = HttpTransport(
+        pool_size=args.http_pool_size,
+        per_host=args.per_host_connections,
+        dns_ttl=0,
+        metrics=metrics,
+    )
+    route_to_mock(transport.session, site.address, transport.pool_size)
+    scraper = AliExpressScraper(
+        output_dir=output_dir,
+        use_selenium=False,
+        metrics=metrics,
+        retry_policy=RetryPolicy(
+            max_attempts=args.max_attempts,
+            deadline=args.request_deadline,
+            is_retryable=is_transient_error,
+        ),
+        circuit_breakers=CircuitBreakerRegistry(
+            cooldown=args.captcha_cooldown, max_cooldown=args.captcha_cooldown * 8
+        ),
+        storage=args.storage,
+        transport=transport,
+        fetch_descriptions=not args.no_descriptions,
+    )
+    pipeline = CrawlPipeline(
+        scraper,
+        target_products=args.products,
+        max_pages=args.max_pages,
+        listing_workers=args.listing_workers,
+        detail_workers=args.detail_workers,
+        persist_workers=args.persist_workers,
+        download_workers=args.download_workers,
+        queue_size=args.queue_size,
+        product_delay=(0, 0),
+    )
+
+    site.start()
+    monitor = Monitor(pipeline, site.started)
+    monitor.start()
+    try:
+        asyncio.run(
+            pipeline.run(
+                search_jobs(args.products, site.items_per_page * args.max_pages)
+            )
+        )
+    finally:
+        monitor.stop()
+        scraper.close()
+        transport.close()
+        site.stop()
+        if not args.output:
+            shutil.rmtree(output_dir, ignore_errors=True)
+
+    samples = monitor.samples
+    duration, saved = samples[-1][0], samples[-1][1]
+    results = {
+        "products": saved,
+        "duration_s": round(duration, 1),
+        "products_per_s": round(saved / duration, 2) if duration else None,
+        "requests": dict(site.requests),
+        "faults_injected": dict(site.injected),
+        "retries": metrics.counter_total("retries_total"),
+        "captchas_seen": metrics.counter_total("captcha_total"),
+        "errors": metrics.counter_total("errors_total"),
+        "still_parked": scraper.breakers.parked_count(),
+    }
+    if window is not None:
+        start, end = window
+        baseline = rate_between(samples, min(5.0, start / 2), start)
+        results["rate_before_throttle"] = baseline and round(baseline, 2)
+        results["rate_during_throttle"] = round(
+            rate_between(samples, start, end) or 0, 2
+        )
+        recovery = recovery_time(samples, end, baseline)
+        results["recovery_s"] = round(recovery, 1) if recovery is not None else None
+    results.update(memory_report(samples, args.products))
+    return results
+
+
+def print_report(results):
+    width = max(len(key) for key in results) + 2
+    for key, value in results.items():
+        if isinstance(value, dict):
+            value = ", ".join(f"{k}={v}" for k, v in sorted(value.items())) or "-"
+        print(f"{key + ':':<{width}} {value}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--products", type=int, default=2000, help="Products to crawl")
+    parser.add_argument(
+        "--max-pages", type=int, default=5, help="Results pages per search"
+    )
+    parser.add_argument("--images-per-product", type=int, default=3)
+    parser.add_argument(
+        "--image-bytes", type=int, default=4096, help="Bytes per synthetic image"
+    )
+    parser.add_argument(
+        "--latency", type=float, default=0, help="Milliseconds added to every response"
+    )
+
+    faults = parser.add_argument_group("fault injection (shares of requests)")
+    faults.add_argument("--rate-limit", type=float, default=0.0, help="429 responses")
+    faults.add_argument("--captcha", type=float, default=0.0, help="Captcha pages")
+    faults.add_argument("--slow", type=float, default=0.0, help="Slow responses")
+    faults.add_argument("--reset", type=float, default=0.0, help="Connection resets")
+    faults.add_argument(
+        "--slow-delay", type=float, default=2.0, help="Seconds a slow response takes"
+    )
+    faults.add_argument(
+        "--retry-after", type=int, default=1, help="Retry-After seconds on 429s"
+    )
+    faults.add_argument(
+        "--throttle-start",
+        type=float,
+        help="Only inject faults from this many seconds into the run",
+    )
+    faults.add_argument(
+        "--throttle-duration",
+        type=float,
+        default=30,
+        help="Seconds the fault window lasts",
+    )
+    faults.add_argument("--seed", type=int, help="Seed for reproducible faults")
+
+    scraper = parser.add_argument_group("scraper settings under test")
+    scraper.add_argument("--listing-workers", type=int, default=1)
+    scraper.add_argument("--detail-workers", type=int, default=4)
+    scraper.add_argument("--persist-workers", type=int, default=2)
+    scraper.add_argument("--download-workers", type=int, default=4)
+    scraper.add_argument("--queue-size", type=int, default=50)
+    scraper.add_argument("--http-pool-size", type=int, default=10)
+    scraper.add_argument("--per-host-connections", type=int, default=6)
+    scraper.add_argument("--max-attempts", type=int, default=4)
+    scraper.add_argument("--request-deadline", type=float, default=90)
+    scraper.add_argument(
+        "--captcha-cooldown",
+        type=float,
+        default=5,
+        help="Seconds a captcha circuit stays open (the real default is 120)",
+    )
+    scraper.add_argument("--storage", choices=["files", "jsonl"], default="jsonl")
+    scraper.add_argument("--no-descriptions", action="store_true")
+
+    parser.add_argument(
+        "--output", help="Keep the scraped output here (default: temporary, removed)"
+    )
+    parser.add_argument(
+        "--log-level", default="WARNING", help="Scraper log level during the run"
+    )
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+    args = parser.parse_args()
+
+    from structured_logging import setup_logging, shutdown_logging
+
+    setup_logging(level=args.log_level, json_output=False)
+    try:
+        results = run_load_test(args)
+    finally:
+        shutdown_logging()
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print_report(results)
+
+
+if __name__ == "__main__":
+    main()
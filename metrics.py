@@ -0,0 +1,240 @@
+import os
+import threading
+import time
+
+# Latency buckets (seconds) tuned for page loads, sleeps and image downloads
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+METRIC_PREFIX = "aliexpress_"
+
+HELP_TEXT = {
+    "stage_duration_seconds": "Time spent in each scraper stage",
+    "captcha_total": "Captcha or unusual traffic pages encountered",
+    "errors_total": "Errors raised while running a stage",
+    "retries_total": "Requests retried after a transient failure",
+    "products_total": "Products saved to disk",
+    "images_downloaded_total": "Images written to disk",
+    "image_bytes_total": "Bytes of image data downloaded",
+    "image_bytes_saved_total": "Image bytes avoided by downloading resized renditions (estimated)",
+    "image_size_fallbacks_total": "Resized renditions missing on the CDN (original used)",
+    "http_requests_total": "Non-browser HTTP requests sent, per host",
+    "search_cache_total": "Search results page lookups in the search cache",
+}
+
+
+class _NullTimer:
+    """Context manager used when metrics are disabled"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class _StageTimer:
+    """Times a block and records it as a histogram observation"""
+
+    __slots__ = ("metrics", "stage", "start")
+
+    def __init__(self, metrics, stage):
+        self.metrics = metrics
+        self.stage = stage
+        self.start = 0.0
+
+    def __enter__(self):
+        if self.metrics.profiler is not None:
+            self.metrics.profiler.enter(self.stage)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.metrics.profiler is not None:
+            self.metrics.profiler.exit()
+        self.metrics.observe(
+            "stage_duration_seconds", time.perf_counter() - self.start, stage=self.stage
+        )
+        if exc_type is not None:
+            self.metrics.inc("errors_total", stage=self.stage)
+        return False
+
+
+class Metrics:
+    """Thread-safe counters and latency histograms with Prometheus text export"""
+
+    def __init__(self, enabled=True, buckets=DEFAULT_BUCKETS, path=None, flush_interval=15):
+        self.enabled = enabled
+        self.buckets = tuple(sorted(buckets))
+        self.path = path
+        self.flush_interval = flush_interval
+        self._last_flush = 0.0
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+        self._server = None
+        # SamplingProfiler told which stage each thread is in (--profile)
+        self.profiler = None
+
+    def inc(self, name, amount=1, **labels):
+        """Increment a counter"""
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def observe(self, name, value, **labels):
+        """Record a single histogram observation"""
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            entry = self._histograms.get(key)
+            if entry is None:
+                # [per-bucket counts, sum, count]
+                entry = [[0] * len(self.buckets), 0.0, 0]
+                self._histograms[key] = entry
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][i] += 1
+                    break
+            entry[1] += value
+            entry[2] += 1
+
+    def timer(self, stage):
+        """Return a context manager timing a named stage"""
+        if not self.enabled:
+            return _NULL_TIMER
+        return _StageTimer(self, stage)
+
+    def profile_stage(self, stage):
+        """Context manager tagging profiler samples with a stage, without timing it"""
+        if self.profiler is None:
+            return _NULL_TIMER
+        return self.profiler.stage(stage)
+
+    def counter_value(self, name, **labels):
+        """Current value of a counter (0 if never incremented)"""
+        with self._lock:
+            return self._counters.get((name, tuple(sorted(labels.items()))), 0)
+
+    def counter_total(self, name):
+        """Sum of a counter across all of its label sets"""
+        with self._lock:
+            return sum(
+                value for (key, _), value in self._counters.items() if key == name
+            )
+
+    def render(self):
+        """Render all metrics in the Prometheus text exposition format"""
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted(
+                (key, (list(entry[0]), entry[1], entry[2]))
+                for key, entry in self._histograms.items()
+            )
+
+        lines = []
+        seen = set()
+        for (name, labels), value in counters:
+            full_name = METRIC_PREFIX + name
+            if full_name not in seen:
+                seen.add(full_name)
+                lines.append(f"# HELP {full_name} {HELP_TEXT.get(name, name)}")
+                lines.append(f"# TYPE {full_name} counter")
+            lines.append(f"{full_name}{_format_labels(labels)} {_format_value(value)}")
+
+        for (name, labels), (bucket_counts, total, count) in histograms:
+            full_name = METRIC_PREFIX + name
+            if full_name not in seen:
+                seen.add(full_name)
+                lines.append(f"# HELP {full_name} {HELP_TEXT.get(name, name)}")
+                lines.append(f"# TYPE {full_name} histogram")
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, bucket_counts):
+                cumulative += bucket_count
+                bucket_labels = labels + (("le", _format_value(bound)),)
+                lines.append(
+                    f"{full_name}_bucket{_format_labels(bucket_labels)} {cumulative}"
+                )
+            inf_labels = labels + (("le", "+Inf"),)
+            lines.append(f"{full_name}_bucket{_format_labels(inf_labels)} {count}")
+            lines.append(f"{full_name}_sum{_format_labels(labels)} {total!r}")
+            lines.append(f"{full_name}_count{_format_labels(labels)} {count}")
+
+        return "\n".join(lines) + "\n"
+
+    def write(self, path):
+        """Atomically write the metrics to a file (node_exporter textfile style)"""
+        if not self.enabled:
+            return
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(self.render())
+        os.replace(tmp_path, path)
+
+    def flush(self, force=False):
+        """Write to the configured file, at most once per flush_interval"""
+        if not self.enabled or not self.path:
+            return
+        now = time.monotonic()
+        if force or now - self._last_flush >= self.flush_interval:
+            self._last_flush = now
+            self.write(self.path)
+
+    def serve(self, port, host="127.0.0.1"):
+        """Expose /metrics over HTTP from a background thread"""
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] not in ("/", "/metrics"):
+                    self.send_error(404)
+                    return
+                body = metrics.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                # Keep scrape requests out of the scraper's output
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        thread.start()
+        return self._server
+
+    def close(self):
+        """Stop the HTTP endpoint if one was started"""
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    parts = []
+    for key, value in labels:
+        value = str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        parts.append(f'{key}="{value}"')
+    return "{" + ",".join(parts) + "}"
+
+
+def _format_value(value):
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+# Shared disabled instance used when no metrics are requested
+NULL_METRICS = Metrics(enabled=False)
@@ -0,0 +1,318 @@
+"""Compressed, append-only archive of raw search and product pages
+
+Usage: python page_archive.py DIR stats
+       python page_archive.py DIR train [--samples N] [--dict-size BYTES]
+
+Pages are written to segment files (``pages-*.arc``), one per scraper
+process, as length-prefixed records of JSON metadata plus the compressed
+HTML. zstd is used when the ``zstandard`` package is installed (with a
+trained dictionary once ``train`` has been run, which shrinks the very
+repetitive AliExpress markup a lot further), zlib otherwise. Records say
+how they were compressed, so segments written either way can be mixed.
+Re-run the extractors over an archive with ``main.py --reextract DIR``.
+"""
+
+import argparse
+import glob
+import json
+import logging
+import os
+import struct
+import threading
+import time
+import zlib
+
+log = logging.getLogger("aliexpress.archive")
+
+RECORD_MAGIC = b"PGA1"
+# magic, codec, metadata length, payload length
+RECORD_HEADER = struct.Struct("<4sBII")
+
+CODEC_ZLIB = 0
+CODEC_ZSTD = 1
+CODEC_ZSTD_DICT = 2
+
+
+def _zstd():
+    try:
+        import zstandard
+    except ImportError:
+        return None
+    return zstandard
+
+
+class PageArchive:
+    """Writes pages to a new segment in ``directory``
+
+    ``max_segment_bytes`` caps a segment's size before the next one is
+    started. The newest trained dictionary in the directory is used
+    automatically. Safe to share between threads: each thread compresses
+    with its own zstd compressor, and only the write is serialized.
+    """
+
+    def __init__(self, directory, level=None, max_segment_bytes=256 << 20):
+        self.directory = directory
+        self.max_segment_bytes = max_segment_bytes
+        self._lock = threading.Lock()
+        self._file = None
+        self._written = 0
+        self._local = threading.local()
+        os.makedirs(directory, exist_ok=True)
+
+        zstandard = _zstd()
+        self.dict_id = None
+        if zstandard is not None:
+            dictionary = load_latest_dictionary(directory)
+            options = {"level": level if level is not None else 10}
+            if dictionary is not None:
+                options["dict_data"] = dictionary
+                self.dict_id = dictionary.dict_id()
+            self._zstd_options = options
+            self.codec = CODEC_ZSTD_DICT if dictionary is not None else CODEC_ZSTD
+        else:
+            self._zstd_options = None
+            self.codec = CODEC_ZLIB
+            self.level = level if level is not None else 6
+
+    def _compress(self, data):
+        if self._zstd_options is None:
+            return zlib.compress(data, self.level)
+        # A ZstdCompressor must not be used by two threads at once
+        compressor = getattr(self._local, "compressor", None)
+        if compressor is None:
+            compressor = _zstd().ZstdCompressor(**self._zstd_options)
+            self._local.compressor = compressor
+        return compressor.compress(data)
+
+    def _open_segment(self):
+        while True:
+            name = f"pages-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-"
+            name += f"{int(time.time() * 1000) % 1000:03d}.arc"
+            path = os.path.join(self.directory, name)
+            try:
+                fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                time.sleep(0.001)
+                continue
+            self._file = os.fdopen(fd, "wb")
+            self._written = 0
+            return
+
+    def append(self, kind, url, html, **meta):
+        """Store one page; ``kind`` is "search", "product" or "category" """
+        data = html.encode("utf-8") if isinstance(html, str) else html
+        payload = self._compress(data)
+        meta.update(kind=kind, url=url, ts=time.time(), size=len(data))
+        if self.dict_id is not None:
+            meta["dict"] = self.dict_id
+        meta_bytes = json.dumps(meta, ensure_ascii=False).encode("utf-8")
+        record = (
+            RECORD_HEADER.pack(RECORD_MAGIC, self.codec, len(meta_bytes), len(payload))
+            + meta_bytes
+            + payload
+        )
+        with self._lock:
+            if self._file is None or self._written >= self.max_segment_bytes:
+                if self._file is not None:
+                    self._file.close()
+                self._open_segment()
+            self._file.write(record)
+            self._written += len(record)
+        return len(payload)
+
+    def flush(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.flush()
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+def segment_paths(directory):
+    return sorted(glob.glob(os.path.join(directory, "pages-*.arc")))
+
+
+def _dictionary_path(directory, dict_id):
+    return os.path.join(directory, f"dictionary-{dict_id}.zdict")
+
+
+def load_latest_dictionary(directory):
+    zstandard = _zstd()
+    paths = glob.glob(os.path.join(directory, "dictionary-*.zdict"))
+    if zstandard is None or not paths:
+        return None
+    with open(max(paths, key=os.path.getmtime), "rb") as f:
+        return zstandard.ZstdCompressionDict(f.read())
+
+
+class _Decompressors:
+    """Per-dictionary zstd decompressors, created on first use"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._cache = {}
+
+    def decompress(self, codec, payload, meta):
+        if codec == CODEC_ZLIB:
+            return zlib.decompress(payload)
+        zstandard = _zstd()
+        if zstandard is None:
+            raise RuntimeError("Archive uses zstd; install the zstandard package")
+        dict_id = meta.get("dict") if codec == CODEC_ZSTD_DICT else None
+        decompressor = self._cache.get(dict_id)
+        if decompressor is None:
+            if dict_id is not None:
+                with open(_dictionary_path(self.directory, dict_id), "rb") as f:
+                    dictionary = zstandard.ZstdCompressionDict(f.read())
+                decompressor = zstandard.ZstdDecompressor(dict_data=dictionary)
+            else:
+                decompressor = zstandard.ZstdDecompressor()
+            self._cache[dict_id] = decompressor
+        return decompressor.decompress(payload)
+
+
+def _scan(directory, kinds=None, load=True):
+    """Yield (metadata, segment, offset, codec, payload) for each record
+
+    The payload is None unless ``load``. A record cut short by a crash ends
+    its segment quietly.
+    """
+    for path in segment_paths(directory):
+        with open(path, "rb", buffering=1 << 20) as f:
+            size = os.fstat(f.fileno()).st_size
+            while True:
+                offset = f.tell()
+                header = f.read(RECORD_HEADER.size)
+                if len(header) < RECORD_HEADER.size:
+                    break
+                magic, codec, meta_length, payload_length = RECORD_HEADER.unpack(header)
+                if magic != RECORD_MAGIC:
+                    log.warning("Corrupt record in %s, skipping the rest", path)
+                    break
+                meta_bytes = f.read(meta_length)
+                if len(meta_bytes) < meta_length or f.tell() + payload_length > size:
+                    break
+                meta = json.loads(meta_bytes)
+                if kinds and meta.get("kind") not in kinds:
+                    f.seek(payload_length, os.SEEK_CUR)
+                    continue
+                if load:
+                    payload = f.read(payload_length)
+                else:
+                    payload = None
+                    f.seek(payload_length, os.SEEK_CUR)
+                yield meta, path, offset, codec, payload
+
+
+def iter_records(directory, kinds=None, decode=True):
+    """Yield (metadata, html) for every archived page, oldest segment first
+
+    With decode=False the html is returned still compressed, as
+    (codec, bytes).
+    """
+    decompressors = _Decompressors(directory)
+    for meta, _, _, codec, payload in _scan(directory, kinds):
+        if not decode:
+            yield meta, (codec, payload)
+            continue
+        html = decompressors.decompress(codec, payload, meta)
+        yield meta, html.decode("utf-8", errors="replace")
+
+
+def iter_locations(directory, kinds=None):
+    """Yield (metadata, (segment, offset)) for every archived page
+
+    Payloads are skipped, not read; load one later with read_record.
+    """
+    for meta, path, offset, _, _ in _scan(directory, kinds, load=False):
+        yield meta, (path, offset)
+
+
+def read_record(segment, offset):
+    """(metadata, codec, payload) of the record at ``offset`` in ``segment``"""
+    with open(segment, "rb") as f:
+        f.seek(offset)
+        magic, codec, meta_length, payload_length = RECORD_HEADER.unpack(
+            f.read(RECORD_HEADER.size)
+        )
+        if magic != RECORD_MAGIC:
+            raise ValueError(f"No archive record at {segment}:{offset}")
+        meta = json.loads(f.read(meta_length))
+        return meta, codec, f.read(payload_length)
+
+
+class ArchiveReader:
+    """Reads single records back by location, e.g. in re-extraction workers
+
+    Keep one for the whole run: its decompressors, and the zstd dictionary
+    each one loads, are reused for every record.
+    """
+
+    def __init__(self, directory):
+        self._decompressors = _Decompressors(directory)
+
+    def read(self, segment, offset):
+        """(metadata, html) of the record at ``offset`` in ``segment``"""
+        meta, codec, payload = read_record(segment, offset)
+        html = self._decompressors.decompress(codec, payload, meta)
+        return meta, html.decode("utf-8", errors="replace")
+
+
+def train_dictionary(directory, samples=2000, dict_size=112640):
+    """Train a zstd dictionary from archived pages; new writers will use it"""
+    zstandard = _zstd()
+    if zstandard is None:
+        raise RuntimeError("Training a dictionary needs the zstandard package")
+    pages = []
+    for _, html in iter_records(directory):
+        pages.append(html.encode("utf-8"))
+        if len(pages) >= samples:
+            break
+    if not pages:
+        raise ValueError(f"No archived pages in {directory} to train on")
+    dictionary = zstandard.train_dictionary(dict_size, pages)
+    path = _dictionary_path(directory, dictionary.dict_id())
+    with open(path, "wb") as f:
+        f.write(dictionary.as_bytes())
+    return path, len(pages)
+
+
+def archive_stats(directory):
+    stats = {"segments": 0, "pages": 0, "raw_bytes": 0, "stored_bytes": 0, "kinds": {}}
+    stats["segments"] = len(segment_paths(directory))
+    for meta, (_, payload) in iter_records(directory, decode=False):
+        stats["pages"] += 1
+        stats["raw_bytes"] += meta.get("size", 0)
+        stats["stored_bytes"] += len(payload)
+        kind = meta.get("kind", "unknown")
+        stats["kinds"][kind] = stats["kinds"].get(kind, 0) + 1
+    if stats["stored_bytes"]:
+        stats["ratio"] = round(stats["raw_bytes"] / stats["stored_bytes"], 2)
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect or tune a page archive")
+    parser.add_argument("directory")
+    parser.add_argument("command", choices=["stats", "train"])
+    parser.add_argument(
+        "--samples", type=int, default=2000, help="Pages to train the dictionary on"
+    )
+    parser.add_argument(
+        "--dict-size", type=int, default=112640, help="Dictionary size in bytes"
+    )
+    args = parser.parse_args()
+
+    if args.command == "stats":
+        print(json.dumps(archive_stats(args.directory), indent=2))
+    else:
+        path, count = train_dictionary(args.directory, args.samples, args.dict_size)
+        print(f"Trained {path} on {count} pages")
+
+
+if __name__ == "__main__":
+    main()
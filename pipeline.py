@@ -0,0 +1,382 @@
+import asyncio
+import functools
+import logging
+import random
+from concurrent.futures import ThreadPoolExecutor
+
+log = logging.getLogger("aliexpress.pipeline")
+
+
+def expand_search_terms(category_structure, count):
+    """Turn the category tree into ("search", payload) listing jobs"""
+    for category in category_structure:
+        for subcategory in category["subcategories"]:
+            for item in subcategory["items"]:
+                yield "search", (category["name"], subcategory["name"], item, count)
+
+
+def expand_category_pages(category_ids, pages_per_category, items_per_page=60):
+    """Turn category ids into ("category", payload) listing jobs"""
+    for category_id in category_ids:
+        for page in range(1, pages_per_category + 1):
+            yield "category", (category_id, page, items_per_page)
+
+
+class CrawlPipeline:
+    """Runs a crawl as asyncio stages connected by bounded queues
+
+    expansion -> listing -> detail -> persist -> images
+
+    Each stage has its own worker count, and a full queue makes the stage
+    before it wait (backpressure), so a slow stage never lets work pile up
+    without bound. Blocking scraper calls run in executors: all Selenium
+    work shares one "browser" thread (a WebDriver is not thread-safe), while
+    HTTP fetches, disk writes and image downloads use a separate pool, so
+    images and records keep flowing while the browser is busy.
+
+    With a CrawlScheduler (crawl_scheduler.py) the jobs are pulled from it
+    one at a time as listing workers free up, saved products are reported
+    back to it and the crawl stops at its deadline. In HTTP mode the number
+    of active detail workers also follows the scheduler, between
+    ``detail_workers`` and ``max_detail_workers``; with Selenium every
+    detail page goes through the one browser thread, so it stays fixed.
+    """
+
+    def __init__(
+        self,
+        scraper,
+        target_products=None,
+        proxy=None,
+        max_pages=5,
+        listing_workers=1,
+        detail_workers=1,
+        max_detail_workers=None,
+        persist_workers=2,
+        download_workers=4,
+        queue_size=50,
+        product_delay=(5, 10),
+        listing_delay=(0, 0),
+        scheduler=None,
+        status_interval=60,
+    ):
+        self.scraper = scraper
+        self.target_products = target_products
+        self.proxy = proxy
+        self.max_pages = max_pages
+        self.listing_workers = listing_workers
+        self.detail_workers = detail_workers
+        self.max_detail_workers = max(max_detail_workers or 0, detail_workers)
+        self.persist_workers = persist_workers
+        self.download_workers = download_workers
+        self.queue_size = queue_size
+        self.product_delay = product_delay
+        self.listing_delay = listing_delay
+        self.scheduler = scheduler
+        self.status_interval = status_interval
+        self.detail_concurrency = detail_workers
+        self.saved = 0
+        self._busy = 0
+
+    async def run(self, jobs):
+        """Run listing jobs through every stage; returns the number of products saved"""
+        self._loop = asyncio.get_running_loop()
+        self._browser = ThreadPoolExecutor(max_workers=1, thread_name_prefix="browser")
+        self._io = ThreadPoolExecutor(
+            max_workers=self.listing_workers
+            + self.max_detail_workers
+            + self.persist_workers
+            + self.download_workers,
+            thread_name_prefix="crawl-io",
+        )
+        self.listing_queue = asyncio.Queue(self.queue_size)
+        self.detail_queue = asyncio.Queue(self.queue_size)
+        self.persist_queue = asyncio.Queue(self.queue_size)
+        self.image_queue = asyncio.Queue(self.queue_size)
+        self.stop = asyncio.Event()
+
+        workers = (
+            [self._spawn(self._listing_worker) for _ in range(self.listing_workers)]
+            + [
+                self._spawn(functools.partial(self._detail_worker, index))
+                for index in range(self.max_detail_workers)
+            ]
+            + [self._spawn(self._persist_worker) for _ in range(self.persist_workers)]
+            + [self._spawn(self._image_worker) for _ in range(self.download_workers)]
+        )
+        if self.scheduler is not None:
+            workers.append(self._spawn(self._watchdog))
+        try:
+            await self._expand(jobs)
+            for queue in (
+                self.listing_queue,
+                self.detail_queue,
+                self.persist_queue,
+                self.image_queue,
+            ):
+                await queue.join()
+        finally:
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            self._browser.shutdown(wait=True)
+            self._io.shutdown(wait=True)
+        return self.saved
+
+    def _spawn(self, worker):
+        return asyncio.create_task(worker())
+
+    async def _call(self, fn, *args, browser=False, stage=None):
+        executor = self._browser if browser else self._io
+        call = functools.partial(fn, *args)
+        if stage is not None:
+            call = functools.partial(self._in_stage, stage, call)
+        return await self._loop.run_in_executor(executor, call)
+
+    def _in_stage(self, stage, call):
+        # Lets --profile attribute executor time to the pipeline stage
+        with self.scraper.metrics.profile_stage(stage):
+            return call()
+
+    @property
+    def _uses_browser(self):
+        return self.scraper.use_selenium
+
+    def _idle(self):
+        return self._busy == 0 and all(
+            queue.empty()
+            for queue in (
+                self.listing_queue,
+                self.detail_queue,
+                self.persist_queue,
+                self.image_queue,
+            )
+        )
+
+    # Stage 1: search-term expansion, plus re-feeding parked work
+
+    async def _expand(self, jobs):
+        for kind, payload in jobs:
+            if self.stop.is_set():
+                return
+            await self.listing_queue.put((kind, payload, 0))
+            if self.scheduler is not None:
+                # Let the scheduler size each job as late as possible
+                while (
+                    self.listing_queue.qsize() >= self.listing_workers
+                    and not self.stop.is_set()
+                ):
+                    await asyncio.sleep(0.2)
+            await self._feed_parked()
+
+        # Keep going until nothing is in flight and nothing is parked
+        breakers = self.scraper.breakers
+        while not self.stop.is_set():
+            await self._feed_parked()
+            if not self._idle():
+                await asyncio.sleep(0.5)
+                continue
+            wait = breakers.next_ready_in()
+            if wait is None:
+                return
+            log.info(
+                "Waiting %.0fs for captcha cool-down (%d parked)",
+                wait,
+                breakers.parked_count(),
+            )
+            await asyncio.sleep(min(max(wait, 0.1), 5))
+
+    async def _feed_parked(self):
+        for key, kind, payload, attempts in self.scraper.breakers.pop_ready():
+            if kind == "product":
+                product_url, context = payload
+                await self.detail_queue.put((product_url, context, attempts))
+            else:
+                await self.listing_queue.put((kind, payload, attempts))
+
+    def _park(self, key, kind, payload, attempts, denied=False):
+        if denied:
+            # The circuit refused it before any request went out; not an attempt
+            self.scraper.breakers.park(key, kind, payload, attempts)
+            return
+        if attempts >= self.scraper.max_park_attempts:
+            log.warning("Dropping %s after %d parked retries", kind, attempts)
+            return
+        self.scraper.breakers.park(key, kind, payload, attempts + 1)
+
+    def _gated(self, fn, *args):
+        """fn(*args), plus whether a captcha circuit refused to let it run"""
+        breakers = self.scraper.breakers
+        breakers.clear_denied()
+        return fn(*args), breakers.denied()
+
+    # Stage 2: listing pages -> product URLs
+
+    def _list(self, kind, payload):
+        if kind == "category":
+            return self.scraper.list_category_products(*payload)
+        category, subcategory, item, count = payload
+        return self.scraper.list_search_products(
+            category, subcategory, item, count, proxy=self.proxy, max_pages=self.max_pages
+        )
+
+    async def _listing_worker(self):
+        while True:
+            kind, payload, attempts = await self.listing_queue.get()
+            self._busy += 1
+            try:
+                if self.stop.is_set():
+                    continue
+                browser = self._uses_browser or kind == "category"
+                listing, denied = await self._call(
+                    self._gated, self._list, kind, payload, browser=browser, stage="listing"
+                )
+                if listing is None:
+                    self._park(
+                        self.scraper.circuit_key(proxy=self.proxy),
+                        kind,
+                        payload,
+                        attempts,
+                        denied,
+                    )
+                    continue
+                for product_url, context in listing:
+                    await self.detail_queue.put((product_url, context, 0))
+                if self.listing_delay[1]:
+                    await asyncio.sleep(random.uniform(*self.listing_delay))
+            except Exception as e:
+                log.error("Error in listing stage: %s", e, extra={"stage": "listing"})
+            finally:
+                self._busy -= 1
+                self.listing_queue.task_done()
+
+    # Stage 3: product detail pages -> product records
+
+    async def _detail_worker(self, index):
+        while True:
+            # Workers beyond the scheduler's current concurrency sit out
+            while index >= self.detail_concurrency:
+                await asyncio.sleep(1)
+            product_url, context, attempts = await self.detail_queue.get()
+            self._busy += 1
+            try:
+                if self.stop.is_set():
+                    continue
+                product_data, denied = await self._call(
+                    self._gated,
+                    self.scraper.extract_product_details,
+                    product_url,
+                    browser=self._uses_browser,
+                    stage="detail",
+                )
+                if product_data.get("parked"):
+                    self._park(
+                        self.scraper.circuit_key(product_url),
+                        "product",
+                        (product_url, context),
+                        attempts,
+                        denied,
+                    )
+                    continue
+                product_data.update(context)
+                await self.persist_queue.put(product_data)
+
+                # Pace detail requests without holding up the other stages
+                await asyncio.sleep(random.uniform(*self.product_delay))
+            except Exception as e:
+                log.error(
+                    "Error in detail stage: %s",
+                    e,
+                    extra={"stage": "detail", "url": product_url},
+                )
+            finally:
+                self._busy -= 1
+                self.detail_queue.task_done()
+
+    # Stage 4: record persistence
+
+    async def _persist_worker(self):
+        while True:
+            product_data = await self.persist_queue.get()
+            self._busy += 1
+            try:
+                product_folder = await self._call(
+                    self.scraper.write_product_record, product_data, stage="persist"
+                )
+                self.saved += 1
+                if self.scheduler is not None:
+                    self.scheduler.record(product_data)
+                if self.target_products and self.saved >= self.target_products:
+                    if not self.stop.is_set():
+                        log.info(
+                            "Reached target of %d products. Stopping.",
+                            self.target_products,
+                        )
+                    self.stop.set()
+                await self.image_queue.put((product_data, product_folder))
+            except Exception as e:
+                log.error(
+                    "Error in persist stage: %s",
+                    e,
+                    extra={
+                        "stage": "save_product",
+                        "product_id": product_data.get("product_id"),
+                    },
+                )
+            finally:
+                self._busy -= 1
+                self.persist_queue.task_done()
+
+    # Stage 5: image downloads
+
+    async def _image_worker(self):
+        while True:
+            product_data, product_folder = await self.image_queue.get()
+            self._busy += 1
+            try:
+                await self._call(
+                    self.scraper.download_product_images,
+                    product_data,
+                    product_folder,
+                    stage="images",
+                )
+            except Exception as e:
+                log.error(
+                    "Error in image stage: %s",
+                    e,
+                    extra={
+                        "stage": "image_download",
+                        "product_id": product_data.get("product_id"),
+                    },
+                )
+            finally:
+                self._busy -= 1
+                self.image_queue.task_done()
+
+    # Deadline and concurrency control
+
+    async def _watchdog(self):
+        scheduler = self.scheduler
+        last_status = self._loop.time()
+        while True:
+            await asyncio.sleep(1)
+            if scheduler.expired():
+                if not self.stop.is_set():
+                    log.info("Crawl deadline reached. Stopping.")
+                    log.info("Crawl status: %s", scheduler.status())
+                self.stop.set()
+                return
+            if self._uses_browser:
+                # One browser thread loads every detail page; nothing to scale
+                concurrency = self.detail_concurrency
+            else:
+                concurrency = scheduler.concurrency(
+                    self.detail_concurrency, self.max_detail_workers
+                )
+            if concurrency != self.detail_concurrency:
+                log.info(
+                    "Detail concurrency %d -> %d", self.detail_concurrency, concurrency
+                )
+                self.detail_concurrency = concurrency
+            if self._loop.time() - last_status >= self.status_interval:
+                last_status = self._loop.time()
+                log.info("Crawl status: %s", scheduler.status())
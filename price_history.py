@@ -0,0 +1,441 @@
+import bisect
+import json
+import logging
+import os
+import re
+import threading
+import time
+from array import array
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+
+log = logging.getLogger("aliexpress.prices")
+
+# Currency markers as they appear on AliExpress price labels, longest first
+# so "US $" wins over "$"
+CURRENCY_SYMBOLS = [
+    ("US $", "USD"),
+    ("US$", "USD"),
+    ("CA $", "CAD"),
+    ("C $", "CAD"),
+    ("AU $", "AUD"),
+    ("A$", "AUD"),
+    ("NZ $", "NZD"),
+    ("MX$", "MXN"),
+    ("R$", "BRL"),
+    ("CN¥", "CNY"),
+    ("руб", "RUB"),
+    ("zł", "PLN"),
+    ("€", "EUR"),
+    ("£", "GBP"),
+    ("₽", "RUB"),
+    ("₩", "KRW"),
+    ("₹", "INR"),
+    ("₺", "TRY"),
+    ("¥", "JPY"),
+    ("$", "USD"),
+]
+
+ISO_CODE_PATTERN = re.compile(r"\b([A-Z]{3})\b")
+KNOWN_CODES = {code for _, code in CURRENCY_SYMBOLS} | {
+    "AED",
+    "CHF",
+    "CLP",
+    "CZK",
+    "DKK",
+    "HUF",
+    "ILS",
+    "NOK",
+    "SAR",
+    "SEK",
+    "VND",
+}
+
+# Currencies without a minor unit; everything else is stored in hundredths
+ZERO_DECIMAL_CURRENCIES = {"JPY", "KRW", "VND", "CLP"}
+
+# A number, with whitespace allowed only as a thousands separator ("1 234"),
+# plus any "%" after it so discounts like "-40%" can be told apart
+NUMBER_PATTERN = re.compile(r"(\d+(?:(?:[.,']|\s(?=\d{3}(?!\d)))\d+)*)(\s*%)?")
+CURRENCY_PATTERN = re.compile(
+    "|".join(re.escape(symbol) for symbol, _ in CURRENCY_SYMBOLS)
+    + r"|(?<![A-Za-z])(?:"
+    + "|".join(sorted(KNOWN_CODES))
+    + r")(?![A-Za-z])"
+)
+RANGE_PATTERN = re.compile(r"\s*[-–~]\s*")
+
+
+def currency_exponent(currency):
+    return 0 if currency in ZERO_DECIMAL_CURRENCIES else 2
+
+
+def _detect_currency(text, default_currency):
+    for token in ISO_CODE_PATTERN.findall(text):
+        if token in KNOWN_CODES:
+            return token
+    for symbol, code in CURRENCY_SYMBOLS:
+        if symbol in text:
+            return code
+    return default_currency
+
+
+def _price_groups(text):
+    """Number tokens of a label, one group per amount: [["12.34", "15.99"], ...]
+
+    Numbers count when they sit next to a currency marker; labels without
+    any marker fall back to every number that isn't a percentage. A number
+    joined to the previous one by a range dash ("$1 - 2", "$1 - $2") extends
+    its group, any other starts a new one ("US $12.34US $20.00" is a sale
+    price followed by the original price).
+    """
+    numbers = [m for m in NUMBER_PATTERN.finditer(text) if not m.group(2)]
+    markers = list(CURRENCY_PATTERN.finditer(text))
+    marker_starts = {m.start() for m in markers}
+    marker_ends = {m.end() for m in markers}
+    groups = []
+    previous_end = None
+    for match in numbers:
+        start, end = match.span(1)
+        in_range = (
+            previous_end is not None
+            and RANGE_PATTERN.fullmatch(CURRENCY_PATTERN.sub("", text[previous_end:start]))
+            is not None
+        )
+        if in_range:
+            groups[-1].append(match.group(1))
+        else:
+            before = text[:start].rstrip()
+            after = len(text) - len(text[end:].lstrip())
+            if markers and len(before) not in marker_ends and after not in marker_starts:
+                continue
+            groups.append([match.group(1)])
+        previous_end = end
+    return groups
+
+
+def _to_minor_units(token, exponent):
+    """'1,234.56' / '1.234,56' / '12,34' / '1 234' -> integer minor units"""
+    token = re.sub(r"[\s']", "", token).strip(".,")
+    if not token:
+        return None
+    if "," in token and "." in token:
+        # Whichever separator comes last is the decimal point
+        decimal_sep = "," if token.rfind(",") > token.rfind(".") else "."
+        group_sep = "." if decimal_sep == "," else ","
+        token = token.replace(group_sep, "").replace(decimal_sep, ".")
+    elif "," in token or "." in token:
+        sep = "," if "," in token else "."
+        head, _, tail = token.rpartition(sep)
+        if token.count(sep) > 1 or len(tail) == 3:
+            # "1,234,567" or "1.234": digit grouping, not decimals
+            token = token.replace(sep, "")
+        else:
+            token = head.replace(sep, "") + "." + tail
+    try:
+        value = Decimal(token)
+    except InvalidOperation:
+        return None
+    return int((value * (10 ** exponent)).quantize(Decimal(1), rounding=ROUND_HALF_UP))
+
+
+def parse_price(text, default_currency="USD"):
+    """Parse a price label into integer minor units
+
+    Returns {"currency", "min", "max"} (min == max unless the label is a range
+    like "US $12.34 - 15.99"), or None for labels without a number such as
+    "Unknown Price". A second amount that isn't part of a range is the
+    original price the sale price replaced ("US $12.34US $20.00") and is
+    returned as "original".
+    """
+    if not text or not isinstance(text, str):
+        return None
+    currency = _detect_currency(text, default_currency)
+    exponent = currency_exponent(currency)
+    amounts = []
+    for group in _price_groups(text):
+        group = [_to_minor_units(t, exponent) for t in group]
+        group = [amount for amount in group if amount is not None]
+        if group:
+            amounts.append(group)
+    if not amounts:
+        return None
+    price = {"currency": currency, "min": min(amounts[0]), "max": max(amounts[0])}
+    if len(amounts) > 1:
+        price["original"] = max(amounts[1])
+    return price
+
+
+def format_price(amount, currency):
+    """Minor units back to a display string, e.g. (1234, "USD") -> "12.34 USD" """
+    exponent = currency_exponent(currency)
+    if exponent == 0:
+        return f"{amount} {currency}"
+    return f"{amount / 10 ** exponent:.{exponent}f} {currency}"
+
+
+# Column name -> array typecode. Rows are appended to one file per column.
+COLUMNS = {
+    "series": "i",  # index into the series keys
+    "timestamp": "I",  # unix seconds
+    "min": "q",  # minor units
+    "max": "q",
+    "currency": "H",  # index into the currency list
+}
+
+
+class PriceHistory:
+    """Append-only price time series keyed by product_id (and SKU)
+
+    Each observation is a row across compact typed columns (``array``), kept
+    in memory and appended to one binary file per column. A row is only
+    written when the price of a series changes, so a product whose price
+    never moves costs one row. Per-series back-links and a latest-row index
+    are rebuilt on load, which keeps ``latest`` O(1), ``min_over`` and
+    ``history`` proportional to that series' changes, and ``changed_since``
+    a binary search plus a scan of the newer rows.
+    """
+
+    def __init__(self, directory, flush_every=1000):
+        self.directory = directory
+        self.flush_every = flush_every
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+        self._columns = {name: array(code) for name, code in COLUMNS.items()}
+        self._series_keys = []
+        self._series_index = {}
+        self._currencies = []
+        self._currency_index = {}
+        # In memory only: previous row of the same series, and each series' last row
+        self._prev = array("i")
+        self._latest = array("i")
+        self._flushed_rows = 0
+        self._flushed_series = 0
+        self._flushed_currencies = 0
+        self._load()
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def _load(self):
+        meta_path = self._path("meta.json")
+        layout = {name: array(code).itemsize for name, code in COLUMNS.items()}
+        if os.path.exists(meta_path):
+            with open(meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            if meta.get("itemsizes") != layout:
+                raise ValueError(
+                    f"Price history in {self.directory} was written with a different "
+                    f"column layout ({meta.get('itemsizes')} != {layout})"
+                )
+        else:
+            with open(meta_path, "w", encoding="utf-8") as f:
+                json.dump({"version": 1, "itemsizes": layout}, f)
+
+        keys_path = self._path("series.jsonl")
+        if os.path.exists(keys_path):
+            good_bytes = 0
+            with open(keys_path, "rb") as f:
+                for line in f:
+                    try:
+                        product_id, sku = json.loads(line)
+                    except ValueError:
+                        break  # torn last line from a crash
+                    if not line.endswith(b"\n"):
+                        break
+                    good_bytes += len(line)
+                    self._series_index[(product_id, sku)] = len(self._series_keys)
+                    self._series_keys.append((product_id, sku))
+            if os.path.getsize(keys_path) != good_bytes:
+                with open(keys_path, "r+b") as f:
+                    f.truncate(good_bytes)
+
+        currencies_path = self._path("currencies.json")
+        if os.path.exists(currencies_path):
+            with open(currencies_path, "r", encoding="utf-8") as f:
+                self._currencies = json.load(f)
+            self._currency_index = {c: i for i, c in enumerate(self._currencies)}
+
+        for name, column in self._columns.items():
+            path = self._path(f"{name}.col")
+            if os.path.exists(path):
+                with open(path, "rb") as f:
+                    data = f.read()
+                usable = len(data) - len(data) % column.itemsize
+                column.frombytes(data[:usable])
+
+        # A crash can leave columns of different lengths, or rows pointing at
+        # series/currencies that never made it to disk; keep the consistent prefix
+        rows = min(len(column) for column in self._columns.values())
+        series = self._columns["series"]
+        currency = self._columns["currency"]
+        if rows and (
+            max(series[:rows]) >= len(self._series_keys)
+            or max(currency[:rows]) >= len(self._currencies)
+        ):
+            for row in range(rows):
+                if (
+                    series[row] >= len(self._series_keys)
+                    or currency[row] >= len(self._currencies)
+                ):
+                    rows = row
+                    break
+        for name, column in self._columns.items():
+            del column[rows:]
+            path = self._path(f"{name}.col")
+            if os.path.exists(path) and os.path.getsize(path) != rows * column.itemsize:
+                with open(path, "r+b") as f:
+                    f.truncate(rows * column.itemsize)
+
+        self._latest = array("i", [-1]) * len(self._series_keys)
+        self._prev = array("i", [-1]) * rows
+        for row in range(rows):
+            s = series[row]
+            self._prev[row] = self._latest[s]
+            self._latest[s] = row
+
+        self._flushed_rows = rows
+        self._flushed_series = len(self._series_keys)
+        self._flushed_currencies = len(self._currencies)
+        if rows:
+            log.info(
+                "Loaded %d price points for %d series from %s",
+                rows,
+                len(self._series_keys),
+                self.directory,
+            )
+
+    def __len__(self):
+        return len(self._columns["series"])
+
+    def _row(self, row):
+        c = self._columns
+        return {
+            "timestamp": c["timestamp"][row],
+            "currency": self._currencies[c["currency"][row]],
+            "min": c["min"][row],
+            "max": c["max"][row],
+        }
+
+    def record(self, product_id, price, sku=None, timestamp=None):
+        """Add an observation; returns True if it was a change and got stored
+
+        ``price`` is a dict from parse_price. Timestamps are kept
+        non-decreasing so the timestamp column stays sorted.
+        """
+        if not price:
+            return False
+        key = (str(product_id), sku)
+        with self._lock:
+            c = self._columns
+            timestamp = int(timestamp if timestamp is not None else time.time())
+            if len(c["timestamp"]):
+                timestamp = max(timestamp, c["timestamp"][-1])
+
+            currency = self._currency_index.get(price["currency"])
+            if currency is None:
+                currency = len(self._currencies)
+                self._currencies.append(price["currency"])
+                self._currency_index[price["currency"]] = currency
+
+            series = self._series_index.get(key)
+            if series is None:
+                series = len(self._series_keys)
+                self._series_keys.append(key)
+                self._series_index[key] = series
+                self._latest.append(-1)
+            else:
+                last = self._latest[series]
+                if (
+                    last >= 0
+                    and c["min"][last] == price["min"]
+                    and c["max"][last] == price["max"]
+                    and c["currency"][last] == currency
+                ):
+                    return False
+
+            row = len(c["series"])
+            c["series"].append(series)
+            c["timestamp"].append(timestamp)
+            c["min"].append(price["min"])
+            c["max"].append(price["max"])
+            c["currency"].append(currency)
+            self._prev.append(self._latest[series])
+            self._latest[series] = row
+
+            if row + 1 - self._flushed_rows >= self.flush_every:
+                self._flush_locked()
+            return True
+
+    def _rows(self, product_id, sku=None):
+        """Row indexes of one series, newest first"""
+        series = self._series_index.get((str(product_id), sku))
+        row = self._latest[series] if series is not None else -1
+        while row >= 0:
+            yield row
+            row = self._prev[row]
+
+    def latest(self, product_id, sku=None):
+        with self._lock:
+            for row in self._rows(product_id, sku):
+                return self._row(row)
+        return None
+
+    def history(self, product_id, sku=None):
+        """All stored changes of a series, oldest first"""
+        with self._lock:
+            rows = list(self._rows(product_id, sku))
+            return [self._row(row) for row in reversed(rows)]
+
+    def min_over(self, product_id, days, sku=None, now=None):
+        """Lowest price (minor units) in effect during the last ``days`` days"""
+        cutoff = (now if now is not None else time.time()) - days * 86400
+        timestamps = self._columns["timestamp"]
+        lowest = None
+        with self._lock:
+            for row in self._rows(product_id, sku):
+                amount = self._columns["min"][row]
+                lowest = amount if lowest is None else min(lowest, amount)
+                # The newest change before the cutoff was still in effect at it
+                if timestamps[row] < cutoff:
+                    break
+        return lowest
+
+    def changed_since(self, timestamp, include_new=False):
+        """(product_id, sku) of series whose price changed at or after ``timestamp``"""
+        c = self._columns
+        changed = {}
+        with self._lock:
+            start = bisect.bisect_left(c["timestamp"], int(timestamp))
+            for row in range(start, len(c["series"])):
+                if include_new or self._prev[row] >= 0:
+                    changed[c["series"][row]] = None
+            return [self._series_keys[series] for series in changed]
+
+    def _flush_locked(self):
+        if len(self._series_keys) > self._flushed_series:
+            with open(self._path("series.jsonl"), "a", encoding="utf-8") as f:
+                for key in self._series_keys[self._flushed_series :]:
+                    f.write(json.dumps(list(key)) + "\n")
+            self._flushed_series = len(self._series_keys)
+        if len(self._currencies) > self._flushed_currencies:
+            tmp_path = self._path("currencies.json.tmp")
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self._currencies, f)
+            os.replace(tmp_path, self._path("currencies.json"))
+            self._flushed_currencies = len(self._currencies)
+
+        # Columns last: rows are only valid once their keys are on disk
+        rows = len(self._columns["series"])
+        if rows > self._flushed_rows:
+            for name, column in self._columns.items():
+                with open(self._path(f"{name}.col"), "ab") as f:
+                    f.write(column[self._flushed_rows :].tobytes())
+            self._flushed_rows = rows
+
+    def flush(self):
+        with self._lock:
+            self._flush_locked()
+
+    def close(self):
+        self.flush()
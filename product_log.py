@@ -0,0 +1,331 @@
+"""Append-only JSONL product log with a memory-mapped offset index
+
+Usage: python product_log.py LOG get PRODUCT_ID
+       python product_log.py LOG scan
+       python product_log.py LOG reindex
+
+Every saved product is one JSON line in LOG; re-saving a product appends a
+newer line and lookups return the latest. ``LOG.idx`` holds a sorted array
+of (hash of product_id, byte offset) records that is memory-mapped, so a
+lookup is a binary search over the mapping plus one read from the log. The
+index header remembers how much of the log it covers; on open anything
+past that point (e.g. after a crash) is tailed back in.
+"""
+
+import argparse
+import hashlib
+import heapq
+import json
+import logging
+import mmap
+import os
+import struct
+import sys
+import threading
+
+log = logging.getLogger("aliexpress.storage")
+
+INDEX_MAGIC = b"PLIX"
+INDEX_VERSION = 1
+# magic, version, record count, log bytes covered by the index
+HEADER = struct.Struct("<4sIQQ")
+# hash of product_id, byte offset of its line in the log
+RECORD = struct.Struct("<QQ")
+
+SCAN_BUFFER = 1 << 20
+
+
+def key_hash(product_id):
+    digest = hashlib.blake2b(str(product_id).encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "little")
+
+
+class ProductLog:
+    """JSONL product records with O(log n) lookups by product_id
+
+    Appends since the index was last written live in an in-memory dict and
+    are merged into the on-disk index every ``merge_every`` records and on
+    close(). The index is rewritten to a temporary file and swapped in, so a
+    crash leaves either the old or the new index, never a torn one.
+    """
+
+    def __init__(self, path, merge_every=50000):
+        self.path = path
+        self.index_path = f"{path}.idx"
+        self.merge_every = merge_every
+        self._lock = threading.RLock()
+        self._pending = {}
+        self._mmap = None
+        self._index_file = None
+        self._count = 0
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._log = open(path, "ab+")
+        self._repair_tail()
+        self._open_index()
+
+    def _repair_tail(self):
+        """Drop a partial last line left by a crash mid-write"""
+        size = os.fstat(self._log.fileno()).st_size
+        if not size:
+            return
+        self._log.seek(size - 1)
+        if self._log.read(1) == b"\n":
+            return
+        # Walk back to the last complete line
+        position = size
+        while position > 0:
+            chunk_start = max(0, position - SCAN_BUFFER)
+            self._log.seek(chunk_start)
+            chunk = self._log.read(position - chunk_start)
+            newline = chunk.rfind(b"\n")
+            if newline != -1:
+                position = chunk_start + newline + 1
+                break
+            position = chunk_start
+        log.warning(
+            "Truncating torn record at the end of %s (%d bytes)",
+            self.path,
+            size - position,
+        )
+        self._log.truncate(position)
+
+    # Index file
+
+    def _open_index(self):
+        log_size = os.fstat(self._log.fileno()).st_size
+        covered = 0
+        try:
+            self._map_index()
+            covered = self._covered
+        except (OSError, ValueError) as e:
+            if os.path.exists(self.index_path):
+                log.warning("Rebuilding index for %s: %s", self.path, e)
+            self._unmap_index()
+            self._count = 0
+
+        if covered > log_size:
+            log.warning("Index of %s is ahead of the log, rebuilding", self.path)
+            self._unmap_index()
+            self._count = 0
+            covered = 0
+        if covered < log_size:
+            tailed = self._tail(covered)
+            log.info("Indexed %d records from the tail of %s", tailed, self.path)
+            self._merge()
+
+    def _map_index(self):
+        self._index_file = open(self.index_path, "rb")
+        header = self._index_file.read(HEADER.size)
+        if len(header) < HEADER.size:
+            raise ValueError("truncated header")
+        magic, version, count, covered = HEADER.unpack(header)
+        if magic != INDEX_MAGIC or version != INDEX_VERSION:
+            raise ValueError("not a product log index")
+        expected = HEADER.size + count * RECORD.size
+        if os.fstat(self._index_file.fileno()).st_size != expected:
+            raise ValueError("index size does not match its header")
+        self._count = count
+        self._covered = covered
+        if count:
+            self._mmap = mmap.mmap(
+                self._index_file.fileno(), 0, access=mmap.ACCESS_READ
+            )
+
+    def _unmap_index(self):
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        if self._index_file is not None:
+            self._index_file.close()
+            self._index_file = None
+
+    def _tail(self, offset):
+        """Index every complete line from ``offset`` to the end of the log"""
+        count = 0
+        with open(self.path, "rb", buffering=SCAN_BUFFER) as f:
+            f.seek(offset)
+            for line in f:
+                try:
+                    product_id = json.loads(line)["product_id"]
+                except (ValueError, KeyError, TypeError):
+                    offset += len(line)
+                    continue
+                self._pending[str(product_id)] = offset
+                offset += len(line)
+                count += 1
+        return count
+
+    def _records(self):
+        """Existing index records in sorted order"""
+        if self._mmap is None:
+            return iter(())
+        return RECORD.iter_unpack(self._mmap[HEADER.size :])
+
+    def _merge(self):
+        """Write index = existing records + pending appends, then remap it"""
+        with self._lock:
+            self._log.flush()
+            covered = os.fstat(self._log.fileno()).st_size
+            pending = sorted(
+                (key_hash(product_id), offset)
+                for product_id, offset in self._pending.items()
+            )
+            merged = heapq.merge(self._records(), pending)
+
+            tmp_path = f"{self.index_path}.tmp"
+            count = 0
+            with open(tmp_path, "wb") as f:
+                f.write(HEADER.pack(INDEX_MAGIC, INDEX_VERSION, 0, covered))
+                buffer = []
+                for record in merged:
+                    buffer.append(RECORD.pack(*record))
+                    count += 1
+                    if len(buffer) >= 65536:
+                        f.write(b"".join(buffer))
+                        buffer = []
+                f.write(b"".join(buffer))
+                f.seek(0)
+                f.write(HEADER.pack(INDEX_MAGIC, INDEX_VERSION, count, covered))
+                f.flush()
+                os.fsync(f.fileno())
+
+            self._unmap_index()
+            os.replace(tmp_path, self.index_path)
+            self._pending = {}
+            self._map_index()
+
+    # Public API
+
+    def __len__(self):
+        """Number of index entries (re-saved products count once per merge)"""
+        with self._lock:
+            return self._count + len(self._pending)
+
+    def append(self, product_data):
+        """Append a product record; returns its byte offset in the log"""
+        line = json.dumps(product_data, ensure_ascii=False).encode("utf-8") + b"\n"
+        with self._lock:
+            self._log.seek(0, os.SEEK_END)
+            offset = self._log.tell()
+            self._log.write(line)
+            self._pending[str(product_data["product_id"])] = offset
+            if len(self._pending) >= self.merge_every:
+                self._merge()
+            return offset
+
+    def _index_offsets(self, target):
+        """Offsets stored for a key hash, newest first"""
+        if self._mmap is None:
+            return []
+        lo, hi = 0, self._count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            key, _ = RECORD.unpack_from(self._mmap, HEADER.size + mid * RECORD.size)
+            if key < target:
+                lo = mid + 1
+            else:
+                hi = mid
+        offsets = []
+        while lo < self._count:
+            key, offset = RECORD.unpack_from(self._mmap, HEADER.size + lo * RECORD.size)
+            if key != target:
+                break
+            offsets.append(offset)
+            lo += 1
+        return sorted(offsets, reverse=True)
+
+    def _read_at(self, offset):
+        with open(self.path, "rb") as f:
+            f.seek(offset)
+            return json.loads(f.readline())
+
+    def get(self, product_id):
+        """Latest record for ``product_id``, or None"""
+        product_id = str(product_id)
+        with self._lock:
+            offset = self._pending.get(product_id)
+            if offset is not None:
+                self._log.flush()
+                return self._read_at(offset)
+            offsets = self._index_offsets(key_hash(product_id))
+            if offsets:
+                self._log.flush()
+        for offset in offsets:
+            record = self._read_at(offset)
+            # Different ids can share a 64-bit hash; check the record itself
+            if str(record.get("product_id")) == product_id:
+                return record
+        return None
+
+    def __contains__(self, product_id):
+        product_id = str(product_id)
+        with self._lock:
+            if product_id in self._pending:
+                return True
+        return self.get(product_id) is not None
+
+    def scan(self):
+        """Stream every record in log order (including superseded ones)"""
+        with self._lock:
+            self._log.flush()
+        with open(self.path, "rb", buffering=SCAN_BUFFER) as f:
+            for line in f:
+                yield json.loads(line)
+
+    def reindex(self):
+        """Rebuild the index from scratch by scanning the whole log"""
+        with self._lock:
+            self._unmap_index()
+            self._count = 0
+            self._pending = {}
+            self._tail(0)
+            self._merge()
+
+    def flush(self):
+        with self._lock:
+            self._log.flush()
+            if self._pending:
+                self._merge()
+
+    def close(self):
+        with self._lock:
+            if self._log.closed:
+                return
+            self.flush()
+            self._unmap_index()
+            self._log.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect a JSONL product log")
+    parser.add_argument("log", help="Path of the products.jsonl log")
+    parser.add_argument("command", choices=["get", "scan", "reindex"])
+    parser.add_argument("product_id", nargs="?")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s %(message)s")
+    product_log = ProductLog(args.log)
+    try:
+        if args.command == "get":
+            if not args.product_id:
+                parser.error("get needs a PRODUCT_ID")
+            record = product_log.get(args.product_id)
+            if record is None:
+                print(f"{args.product_id} not found", file=sys.stderr)
+                sys.exit(1)
+            print(json.dumps(record, indent=4, ensure_ascii=False))
+        elif args.command == "scan":
+            for record in product_log.scan():
+                print(json.dumps(record, ensure_ascii=False))
+        else:
+            product_log.reindex()
+            print(f"Indexed {len(product_log)} records")
+    finally:
+        product_log.close()
+
+
+if __name__ == "__main__":
+    main()
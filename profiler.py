@@ -0,0 +1,206 @@
+"""Sampling profiler that attributes time to named scraper stages
+
+Usage: python main.py --profile [DIR] ...
+
+A background thread samples every thread's Python stack at a fixed
+interval. Each sample is tagged with the stages the thread is inside (the
+pipeline stage plus any ``metrics.timer`` stage, e.g.
+"detail;detail_page_load") and split into CPU and waiting time from the
+thread's own CPU clock, so a stage that is slow because it sleeps or waits
+on the network looks different from one that is slow because it parses.
+
+Written to DIR at the end of the run:
+
+- ``wall.folded`` / ``cpu.folded``: collapsed stacks ("stage;...;frame ms")
+  for flamegraph.pl, speedscope or inferno;
+- ``summary.txt``: per-stage wall/CPU/wait table and the hottest functions.
+"""
+
+import os
+import sys
+import threading
+import time
+from collections import defaultdict
+
+UNSTAGED = "(unstaged)"
+
+
+class _StageScope:
+    """Marks the current thread as inside a named stage while active"""
+
+    __slots__ = ("profiler", "stage")
+
+    def __init__(self, profiler, stage):
+        self.profiler = profiler
+        self.stage = stage
+
+    def __enter__(self):
+        self.profiler.enter(self.stage)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.profiler.exit()
+        return False
+
+
+class SamplingProfiler:
+    """Samples all threads every ``interval`` seconds while running"""
+
+    def __init__(self, interval=0.005, max_depth=64):
+        self.interval = interval
+        self.max_depth = max_depth
+        self.samples = 0
+        self.started = None
+        self.duration = 0.0
+        self._stages = {}
+        self._thread = None
+        self._stop = threading.Event()
+        self._clocks = {}
+        self._last_cpu = {}
+        # (stage path, stack) -> [wall seconds, cpu seconds]
+        self._stacks = defaultdict(lambda: [0.0, 0.0])
+
+    # Stage tracking (called from the scraper's threads)
+
+    def enter(self, stage):
+        self._stages.setdefault(threading.get_ident(), []).append(stage)
+
+    def exit(self):
+        ident = threading.get_ident()
+        stages = self._stages.get(ident)
+        if stages:
+            stages.pop()
+            if not stages:
+                del self._stages[ident]
+
+    def stage(self, name):
+        return _StageScope(self, name)
+
+    # Sampling
+
+    def start(self):
+        self.started = time.perf_counter()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+        self.duration = time.perf_counter() - self.started
+
+    def _thread_cpu(self, ident):
+        """CPU seconds used by a thread so far, or None if unavailable"""
+        clock = self._clocks.get(ident)
+        try:
+            if clock is None:
+                clock = self._clocks[ident] = time.pthread_getcpuclockid(ident)
+            return time.clock_gettime(clock)
+        except (AttributeError, OSError):
+            return None
+
+    def _run(self):
+        own = threading.get_ident()
+        last = time.perf_counter()
+        while not self._stop.wait(self.interval):
+            now = time.perf_counter()
+            elapsed, last = now - last, now
+            self._sample(own, elapsed)
+
+    def _sample(self, own, elapsed):
+        frames = sys._current_frames()
+        for ident, frame in frames.items():
+            if ident == own:
+                continue
+            cpu = self._thread_cpu(ident)
+            previous = self._last_cpu.get(ident)
+            self._last_cpu[ident] = cpu
+            if cpu is None or previous is None:
+                cpu_share = 0.0
+            else:
+                cpu_share = min(max(cpu - previous, 0.0), elapsed)
+
+            stack = []
+            while frame is not None and len(stack) < self.max_depth:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)})")
+                frame = frame.f_back
+            stack.reverse()
+            stages = tuple(self._stages.get(ident) or (UNSTAGED,))
+            entry = self._stacks[(stages, tuple(stack))]
+            entry[0] += elapsed
+            entry[1] += cpu_share
+        self.samples += 1
+        # Forget threads that have exited
+        for ident in set(self._last_cpu) - set(frames):
+            self._last_cpu.pop(ident, None)
+            self._clocks.pop(ident, None)
+
+    # Reports
+
+    def collapsed(self, cpu=False):
+        """Collapsed-stack lines ("stage;...;frame milliseconds")"""
+        totals = defaultdict(float)
+        for (stages, stack), (wall, cpu_time) in self._stacks.items():
+            value = cpu_time if cpu else wall
+            if value > 0:
+                totals[";".join(stages + stack)] += value
+        return [
+            f"{path} {round(value * 1000)}"
+            for path, value in sorted(totals.items())
+            if round(value * 1000)
+        ]
+
+    def stage_table(self):
+        """[(stage, wall, cpu)] by innermost stage, largest wall time first"""
+        totals = defaultdict(lambda: [0.0, 0.0])
+        for (stages, _), (wall, cpu_time) in self._stacks.items():
+            totals[stages[-1]][0] += wall
+            totals[stages[-1]][1] += cpu_time
+        return sorted(
+            ((stage, wall, cpu_time) for stage, (wall, cpu_time) in totals.items()),
+            key=lambda row: row[1],
+            reverse=True,
+        )
+
+    def hot_functions(self, limit=20):
+        """[(function, self cpu, self wall)] for the leaf frames burning most CPU"""
+        totals = defaultdict(lambda: [0.0, 0.0])
+        for (_, stack), (wall, cpu_time) in self._stacks.items():
+            if stack:
+                totals[stack[-1]][0] += cpu_time
+                totals[stack[-1]][1] += wall
+        rows = sorted(totals.items(), key=lambda item: item[1][0], reverse=True)
+        return [(name, cpu_time, wall) for name, (cpu_time, wall) in rows[:limit]]
+
+    def summary(self):
+        lines = [
+            f"Profiled {self.duration:.1f}s, {self.samples} samples every "
+            f"{self.interval * 1000:g}ms (thread seconds below)",
+            "",
+            f"{'stage':<28} {'wall s':>10} {'cpu s':>10} {'wait s':>10} {'cpu %':>6}",
+        ]
+        for stage, wall, cpu_time in self.stage_table():
+            share = 100 * cpu_time / wall if wall else 0
+            lines.append(
+                f"{stage:<28} {wall:>10.2f} {cpu_time:>10.2f} "
+                f"{wall - cpu_time:>10.2f} {share:>5.0f}%"
+            )
+        lines += ["", f"{'hottest functions (self)':<60} {'cpu s':>8} {'wall s':>8}"]
+        for name, cpu_time, wall in self.hot_functions():
+            lines.append(f"{name[:60]:<60} {cpu_time:>8.2f} {wall:>8.2f}")
+        return "\n".join(lines)
+
+    def write(self, directory):
+        """Write the folded stacks and summary; returns the summary text"""
+        os.makedirs(directory, exist_ok=True)
+        for name, cpu in (("wall.folded", False), ("cpu.folded", True)):
+            with open(os.path.join(directory, name), "w", encoding="utf-8") as f:
+                f.write("\n".join(self.collapsed(cpu=cpu)) + "\n")
+        summary = self.summary()
+        with open(os.path.join(directory, "summary.txt"), "w", encoding="utf-8") as f:
+            f.write(summary + "\n")
+        return summary
@@ -0,0 +1,201 @@
+import logging
+import random
+import threading
+import time
+
+log = logging.getLogger("aliexpress.proxy")
+
+
+class ProxyStats:
+    """Health tracking for one proxy"""
+
+    def __init__(self, url, max_concurrency=2):
+        self.url = url
+        self.max_concurrency = max_concurrency
+        self.in_flight = 0
+        self.successes = 0
+        self.failures = 0
+        self.captchas = 0
+        self.latency = None  # exponentially weighted moving average, seconds
+        self.consecutive_failures = 0
+        self.evicted_until = 0.0
+        self.evictions = 0
+        self.probing = False
+
+    @property
+    def proxies(self):
+        """Mapping in the form requests expects for its proxies= argument"""
+        return {"http": self.url, "https": self.url}
+
+    @property
+    def requests(self):
+        return self.successes + self.failures + self.captchas
+
+    def success_rate(self):
+        # Laplace smoothing so fresh proxies start at 0.5 rather than 0 or 1
+        return (self.successes + 1) / (self.requests + 2)
+
+    def captcha_rate(self):
+        return self.captchas / (self.requests + 1)
+
+    def score(self):
+        """Selection weight: reliable, captcha-free and fast proxies score higher"""
+        latency = self.latency if self.latency is not None else 1.0
+        return self.success_rate() * (1.0 - self.captcha_rate()) / (1.0 + latency)
+
+    def to_dict(self):
+        return {
+            "url": self.url,
+            "score": round(self.score(), 4),
+            "latency": round(self.latency, 3) if self.latency is not None else None,
+            "successes": self.successes,
+            "failures": self.failures,
+            "captchas": self.captchas,
+            "in_flight": self.in_flight,
+            "evicted": self.evicted_until > time.monotonic(),
+        }
+
+
+class ProxyPool:
+    """Weighted-random proxy selection with per-proxy concurrency limits
+
+    Proxies are scored on latency, success rate and captcha rate. A proxy
+    that fails ``max_failures`` times in a row, or gets a captcha, is evicted
+    for ``eviction_time`` seconds (doubling on repeat evictions). Once the
+    eviction expires it is probed in the background with ``probe`` and only
+    returns to rotation if the probe succeeds.
+    """
+
+    def __init__(
+        self,
+        proxy_urls,
+        max_concurrency=2,
+        max_failures=3,
+        eviction_time=300,
+        max_eviction_time=3600,
+        probe=None,
+        latency_alpha=0.3,
+    ):
+        if not proxy_urls:
+            raise ValueError("ProxyPool needs at least one proxy")
+        self.proxies = [ProxyStats(url, max_concurrency) for url in proxy_urls]
+        self.max_failures = max_failures
+        self.eviction_time = eviction_time
+        self.max_eviction_time = max_eviction_time
+        self.probe = probe
+        self.latency_alpha = latency_alpha
+        self._cond = threading.Condition()
+
+    @classmethod
+    def from_file(cls, path, **options):
+        """Load one proxy URL per line; blank lines and # comments are skipped"""
+        with open(path, "r", encoding="utf-8") as f:
+            urls = [
+                line.strip()
+                for line in f
+                if line.strip() and not line.strip().startswith("#")
+            ]
+        return cls(urls, **options)
+
+    def __len__(self):
+        return len(self.proxies)
+
+    def acquire(self, timeout=60):
+        """Pick a proxy by weighted random choice, waiting for a free slot"""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                self._start_probes(now)
+                available = [
+                    p
+                    for p in self.proxies
+                    if p.evicted_until <= now
+                    and not p.probing
+                    and p.in_flight < p.max_concurrency
+                ]
+                if available:
+                    weights = [max(p.score(), 1e-6) for p in available]
+                    proxy = random.choices(available, weights=weights)[0]
+                    proxy.in_flight += 1
+                    return proxy
+
+                remaining = deadline - now
+                if remaining <= 0:
+                    raise TimeoutError("No healthy proxy available")
+                # Wake up on release, or when the next eviction expires
+                next_expiry = min(
+                    (p.evicted_until for p in self.proxies if p.evicted_until > now),
+                    default=now + remaining,
+                )
+                self._cond.wait(min(remaining, max(0.05, next_expiry - now)))
+
+    def release(self, proxy, latency=None, ok=True, captcha=False):
+        """Return a proxy to the pool and record the outcome of its request"""
+        with self._cond:
+            proxy.in_flight = max(0, proxy.in_flight - 1)
+            if latency is not None:
+                if proxy.latency is None:
+                    proxy.latency = latency
+                else:
+                    proxy.latency += self.latency_alpha * (latency - proxy.latency)
+
+            if captcha:
+                proxy.captchas += 1
+                self._evict(proxy, "captcha")
+            elif ok:
+                proxy.successes += 1
+                proxy.consecutive_failures = 0
+            else:
+                proxy.failures += 1
+                proxy.consecutive_failures += 1
+                if proxy.consecutive_failures >= self.max_failures:
+                    self._evict(proxy, f"{proxy.consecutive_failures} failures in a row")
+            self._cond.notify_all()
+
+    def _evict(self, proxy, reason):
+        duration = min(
+            self.eviction_time * (2 ** proxy.evictions), self.max_eviction_time
+        )
+        proxy.evictions += 1
+        proxy.evicted_until = time.monotonic() + duration
+        proxy.consecutive_failures = 0
+        log.warning(
+            "Evicting proxy %s for %ds (%s)",
+            proxy.url,
+            duration,
+            reason,
+            extra={"stage": "proxy"},
+        )
+
+    def _start_probes(self, now):
+        """Probe proxies whose eviction has expired (called with the lock held)"""
+        if self.probe is None:
+            return
+        for proxy in self.proxies:
+            # evicted_until is reset to 0 once a proxy is back in rotation
+            if 0.0 < proxy.evicted_until <= now and not proxy.probing:
+                proxy.probing = True
+                threading.Thread(
+                    target=self._run_probe, args=(proxy,), daemon=True
+                ).start()
+
+    def _run_probe(self, proxy):
+        start = time.monotonic()
+        try:
+            ok = bool(self.probe(proxy))
+        except Exception:
+            ok = False
+        with self._cond:
+            proxy.probing = False
+            if ok:
+                proxy.evicted_until = 0.0
+                proxy.latency = time.monotonic() - start
+                log.info("Proxy %s passed probe, back in rotation", proxy.url)
+            else:
+                self._evict(proxy, "probe failed")
+            self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            return [p.to_dict() for p in self.proxies]
@@ -0,0 +1,143 @@
+import logging
+import random
+import threading
+import time
+
+log = logging.getLogger("aliexpress.retry")
+
+# Statuses worth repeating: timeouts, throttling and transient server errors
+RETRYABLE_STATUSES = frozenset({408, 425, 429, 500, 502, 503, 504})
+
+
+class RetryBudget:
+    """Caps retries to a fraction of overall traffic
+
+    Every first attempt deposits ``ratio`` tokens and every retry spends one,
+    so when the site is down retries can't multiply the load beyond roughly
+    ``1 + ratio`` times the normal request rate. ``min_tokens`` keeps a few
+    retries available at the start of a run.
+    """
+
+    def __init__(self, ratio=0.2, min_tokens=10, max_tokens=100):
+        self.ratio = ratio
+        self.max_tokens = max_tokens
+        self.tokens = float(min_tokens)
+        self._lock = threading.Lock()
+
+    def record_request(self):
+        with self._lock:
+            self.tokens = min(self.max_tokens, self.tokens + self.ratio)
+
+    def try_spend(self):
+        with self._lock:
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+
+class RetryPolicy:
+    """Per-request retries with decorrelated-jitter exponential backoff
+
+    ``call(fn)`` runs ``fn(remaining)`` where ``remaining`` is the number of
+    seconds left before the request deadline (use it to bound timeouts).
+    Exceptions are retried when ``is_retryable(exc)`` says so; results with a
+    ``status_code`` in ``retry_statuses`` are retried too, honouring a
+    Retry-After header. Retries stop at ``max_attempts``, at the deadline, or
+    when the shared budget runs dry - the last error/response is returned
+    to the caller unchanged.
+    """
+
+    def __init__(
+        self,
+        max_attempts=4,
+        base_delay=0.5,
+        max_delay=30.0,
+        deadline=90.0,
+        retry_statuses=RETRYABLE_STATUSES,
+        is_retryable=None,
+        budget=None,
+        on_retry=None,
+        sleep=time.sleep,
+    ):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.deadline = deadline
+        self.retry_statuses = frozenset(retry_statuses)
+        self.is_retryable = is_retryable or _default_is_retryable
+        self.budget = budget if budget is not None else RetryBudget()
+        self.on_retry = on_retry
+        self.sleep = sleep
+
+    def next_delay(self, previous):
+        """Decorrelated jitter: uniform between base and 3x the previous delay"""
+        return min(self.max_delay, random.uniform(self.base_delay, previous * 3))
+
+    def call(self, fn, stage="request", deadline=None):
+        deadline = self.deadline if deadline is None else deadline
+        give_up_at = time.monotonic() + deadline
+        delay = self.base_delay
+        self.budget.record_request()
+
+        attempt = 0
+        while True:
+            attempt += 1
+            remaining = max(0.1, give_up_at - time.monotonic())
+            error = None
+            try:
+                result = fn(remaining)
+            except Exception as e:
+                if not self.is_retryable(e):
+                    raise
+                error = e
+                reason = f"{type(e).__name__}: {e}"
+                retry_after = None
+            else:
+                status = getattr(result, "status_code", None)
+                if status not in self.retry_statuses:
+                    return result
+                reason = f"status {status}"
+                retry_after = _retry_after_seconds(result)
+
+            delay = self.next_delay(delay)
+            if retry_after is not None:
+                delay = min(self.max_delay, max(delay, retry_after))
+
+            if (
+                attempt >= self.max_attempts
+                or time.monotonic() + delay > give_up_at
+                or not self.budget.try_spend()
+            ):
+                if error is not None:
+                    raise error
+                return result
+
+            log.info(
+                "Retrying %s in %.1fs (attempt %d/%d, %s)",
+                stage,
+                delay,
+                attempt + 1,
+                self.max_attempts,
+                reason,
+                extra={"stage": stage},
+            )
+            if self.on_retry is not None:
+                self.on_retry(stage, attempt, delay, reason)
+            self.sleep(delay)
+
+
+def _default_is_retryable(exc):
+    return isinstance(exc, (ConnectionError, TimeoutError))
+
+
+def _retry_after_seconds(response):
+    headers = getattr(response, "headers", None) or {}
+    value = headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        # HTTP-date form isn't worth parsing here; fall back to backoff
+        return None
@@ -0,0 +1,113 @@
+import json
+import logging
+import sqlite3
+import threading
+import time
+
+log = logging.getLogger("aliexpress.search")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS pages (
+    term TEXT NOT NULL,
+    page INTEGER NOT NULL,
+    cards TEXT NOT NULL,
+    created REAL NOT NULL,
+    accessed REAL NOT NULL,
+    PRIMARY KEY (term, page)
+);
+CREATE INDEX IF NOT EXISTS pages_accessed ON pages (accessed);
+"""
+
+
+def normalize_term(term):
+    """Cache key for a search term: case and spacing don't matter"""
+    return " ".join(str(term).lower().split())
+
+
+class SearchCache:
+    """Listing cards per (search term, results page) in a SQLite file
+
+    Entries are fresh for ``ttl`` seconds, and once more than
+    ``max_entries`` pages are stored the least recently used ones are
+    dropped. The file persists between runs, so a crawl restarted within
+    the freshness window doesn't reload the searches it already did. Each
+    thread gets its own connection, so one cache can be shared by the
+    search prefetch thread and the workers.
+    """
+
+    def __init__(self, path, ttl=6 * 3600, max_entries=5000):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._db().executescript(SCHEMA)
+
+    def _db(self):
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self._local.db = db
+        return db
+
+    def contains(self, term, page):
+        """Whether a fresh entry exists (doesn't count as a hit or touch it)"""
+        row = self._db().execute(
+            "SELECT 1 FROM pages WHERE term = ? AND page = ? AND created > ?",
+            (normalize_term(term), page, time.time() - self.ttl),
+        ).fetchone()
+        return row is not None
+
+    def get(self, term, page):
+        """Cached cards for a results page, or None if missing or stale"""
+        now = time.time()
+        term = normalize_term(term)
+        db = self._db()
+        row = db.execute(
+            "SELECT cards, created FROM pages WHERE term = ? AND page = ?",
+            (term, page),
+        ).fetchone()
+        if row is None or row[1] <= now - self.ttl:
+            if row is not None:
+                db.execute("DELETE FROM pages WHERE term = ? AND page = ?", (term, page))
+            with self._lock:
+                self.misses += 1
+            return None
+        db.execute(
+            "UPDATE pages SET accessed = ? WHERE term = ? AND page = ?",
+            (now, term, page),
+        )
+        with self._lock:
+            self.hits += 1
+        return json.loads(row[0])
+
+    def put(self, term, page, cards):
+        now = time.time()
+        db = self._db()
+        db.execute(
+            "INSERT OR REPLACE INTO pages (term, page, cards, created, accessed)"
+            " VALUES (?, ?, ?, ?, ?)",
+            (normalize_term(term), page, json.dumps(cards), now, now),
+        )
+        db.execute(
+            "DELETE FROM pages WHERE rowid IN (SELECT rowid FROM pages"
+            " ORDER BY accessed DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,),
+        )
+
+    def prune(self):
+        """Drop stale entries; returns how many were removed"""
+        cursor = self._db().execute(
+            "DELETE FROM pages WHERE created <= ?", (time.time() - self.ttl,)
+        )
+        return cursor.rowcount
+
+    def close(self):
+        db = getattr(self._local, "db", None)
+        if db is not None:
+            db.close()
+            self._local.db = None
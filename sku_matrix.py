@@ -0,0 +1,182 @@
+import json
+import re
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+
+from price_history import currency_exponent, parse_price
+
+# Where product pages have kept their embedded state over the years
+STATE_MARKERS = ("window.runParams", "window.__INIT_DATA__", "window._d_c_.DCData")
+DATA_KEY_PATTERN = re.compile(r"""["']?data["']?\s*:\s*\{""")
+
+SKU_COLUMNS = ["sku_id", "values", "price", "sale_price", "stock"]
+
+
+def extract_embedded_state(html, markers=STATE_MARKERS):
+    """Pull the product state object out of a page's inline scripts
+
+    Returns the dict holding skuModule/skuComponent/priceComponent, or None.
+    The state is assigned as a JS object literal (``{ data: {...}, ... }``)
+    so only the JSON ``data`` object inside it is decoded.
+    """
+    decoder = json.JSONDecoder()
+    for marker in markers:
+        start = html.find(marker)
+        while start != -1:
+            match = DATA_KEY_PATTERN.search(html, start, start + 2000)
+            if match:
+                try:
+                    data, _ = decoder.raw_decode(html, match.end() - 1)
+                except ValueError:
+                    data = None
+                if isinstance(data, dict):
+                    return data
+            start = html.find(marker, start + len(marker))
+    return None
+
+
+def sku_state_parts(data):
+    """(property list, price list) from an embedded state dict"""
+    if not isinstance(data, dict):
+        return [], []
+    if isinstance(data.get("data"), dict):
+        data = data["data"]
+    sku_module = data.get("skuModule") or data.get("skuComponent") or {}
+    price_module = data.get("priceComponent") or {}
+    properties = sku_module.get("productSKUPropertyList") or []
+    prices = sku_module.get("skuPriceList") or price_module.get("skuPriceList") or []
+    return properties, prices
+
+
+def _amount(value, currency):
+    """A JSON amount ({value, currency} dict, number or label) in minor units"""
+    if isinstance(value, dict):
+        currency = value.get("currency") or currency
+        if value.get("value") is not None:
+            value = value["value"]
+        else:
+            value = value.get("formatedAmount")
+    if value is None or value == "":
+        return None, currency
+    if isinstance(value, str) and not re.fullmatch(r"\s*\d+(\.\d+)?\s*", value):
+        parsed = parse_price(value, default_currency=currency)
+        return (parsed["min"], parsed["currency"]) if parsed else (None, currency)
+    try:
+        exponent = currency_exponent(currency)
+        scaled = Decimal(str(value).strip()) * (10 ** exponent)
+    except InvalidOperation:
+        return None, currency
+    return int(scaled.quantize(Decimal(1), rounding=ROUND_HALF_UP)), currency
+
+
+def build_sku_matrix(properties, prices, default_currency="USD", fix_image_url=None):
+    """Compact SKU matrix from the page's property and price lists
+
+    Properties keep their values once; each SKU row is
+    ``[sku_id, value indexes per property, price, sale_price, stock]`` with
+    prices in integer minor units of ``currency`` and -1 for a property the
+    SKU doesn't use. Returns None when the page has no SKU price list.
+    """
+    if not prices:
+        return None
+
+    compact_properties = []
+    value_positions = {}
+    for prop_index, prop in enumerate(properties):
+        values = []
+        for value_index, value in enumerate(prop.get("skuPropertyValues") or []):
+            image = value.get("skuPropertyImagePath") or value.get(
+                "skuPropertyImageSummPath"
+            )
+            if image and fix_image_url is not None:
+                image = fix_image_url(image)
+            value_id = value.get("propertyValueId") or value.get("propertyValueIdLong")
+            values.append(
+                {
+                    "id": value_id,
+                    "name": value.get("propertyValueDisplayName")
+                    or value.get("propertyValueName")
+                    or value.get("skuPropertyTips"),
+                    "image": image or None,
+                }
+            )
+            key = (str(prop.get("skuPropertyId")), str(value_id))
+            value_positions[key] = (prop_index, value_index)
+        compact_properties.append(
+            {
+                "id": prop.get("skuPropertyId"),
+                "name": prop.get("skuPropertyName"),
+                "values": values,
+            }
+        )
+
+    currency = default_currency
+    rows = []
+    for sku in prices:
+        value = sku.get("skuVal") or {}
+        indexes = [-1] * len(compact_properties)
+        # "14:193,5:100014064" or "14:193#Black;5:100014064": property id : value id
+        pairs = re.split(r"[,;]", sku.get("skuPropIds") or sku.get("skuAttr") or "")
+        for pair in pairs:
+            pair = pair.split("#")[0]
+            if ":" not in pair:
+                continue
+            position = value_positions.get(tuple(p.strip() for p in pair.split(":", 1)))
+            if position is not None:
+                indexes[position[0]] = position[1]
+
+        price, currency = _amount(
+            value.get("skuAmount") or value.get("skuCalPrice"), currency
+        )
+        sale_price, currency = _amount(
+            value.get("skuActivityAmount") or value.get("actSkuCalPrice"), currency
+        )
+        stock = value.get("availQuantity", value.get("inventory"))
+        rows.append(
+            [
+                sku.get("skuIdStr") or str(sku.get("skuId", "")),
+                indexes,
+                price,
+                sale_price if sale_price is not None else price,
+                int(stock) if stock is not None else None,
+            ]
+        )
+
+    return {
+        "currency": currency,
+        "properties": compact_properties,
+        "columns": SKU_COLUMNS,
+        "skus": rows,
+    }
+
+
+def expand_sku_matrix(matrix):
+    """One dict per SKU with option names, prices, stock and image"""
+    if not matrix:
+        return []
+    properties = matrix["properties"]
+    expanded = []
+    for row in matrix["skus"]:
+        sku = dict(zip(matrix["columns"], row))
+        options = {}
+        image = None
+        for prop, index in zip(properties, sku.pop("values")):
+            if index < 0:
+                continue
+            value = prop["values"][index]
+            options[prop["name"]] = value["name"]
+            image = image or value["image"]
+        sku.update(options=options, image=image, currency=matrix["currency"])
+        expanded.append(sku)
+    return expanded
+
+
+def variants_from_matrix(matrix):
+    """Variant list in the scraper's {property_type, name, image} form"""
+    variants = []
+    for prop in (matrix or {}).get("properties", []):
+        for value in prop["values"]:
+            variant = {"property_type": prop["name"], "name": value["name"]}
+            if value["image"]:
+                variant["image"] = value["image"]
+            variants.append(variant)
+    return variants
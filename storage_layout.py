@@ -0,0 +1,190 @@
+"""Output directory layouts and filename allocation
+
+Usage: python storage_layout.py migrate OUTPUT_DIR [--dry-run]
+
+"flat" is the original layout, one ``<product_id>_<title>`` folder per
+product directly under the output directory. "sharded" spreads products
+over ``ab/cd/<product_id>/`` (first hex digits of a hash of the id) so no
+directory grows past a few hundred entries. The layout in use is recorded
+in ``OUTPUT_DIR/.layout``; the migrate command moves a flat tree over.
+"""
+
+import argparse
+import hashlib
+import json
+import logging
+import os
+import threading
+
+log = logging.getLogger("aliexpress.storage")
+
+LAYOUT_FILE = ".layout"
+FLAT = "flat"
+SHARDED = "sharded"
+
+
+def safe_component(text, limit=None):
+    """Make a string safe to use as one path component"""
+    text = str(text)[:limit] if limit else str(text)
+    text = text.replace("/", "-").replace("\\", "-")
+    return "".join(c if c.isalnum() or c in "- " else "_" for c in text)
+
+
+def shard_prefix(product_id, depth=2, width=2):
+    """'ab/cd' style prefix from the md5 of the product id"""
+    digest = hashlib.md5(str(product_id).encode("utf-8")).hexdigest()
+    return os.path.join(*(digest[i * width : (i + 1) * width] for i in range(depth)))
+
+
+def sharded_folder(output_dir, product_id):
+    return os.path.join(
+        output_dir, shard_prefix(product_id), safe_component(product_id)
+    )
+
+
+def _is_product_folder(path):
+    return os.path.isfile(os.path.join(path, "product_data.json"))
+
+
+def detect_layout(output_dir):
+    """Layout recorded for ``output_dir``; unmarked trees with products are flat"""
+    try:
+        with open(os.path.join(output_dir, LAYOUT_FILE), "r", encoding="utf-8") as f:
+            return f.read().strip() or SHARDED
+    except FileNotFoundError:
+        pass
+    try:
+        with os.scandir(output_dir) as entries:
+            for entry in entries:
+                if entry.is_dir() and _is_product_folder(entry.path):
+                    return FLAT
+    except FileNotFoundError:
+        pass
+    return SHARDED
+
+
+def write_layout(output_dir, layout):
+    os.makedirs(output_dir, exist_ok=True)
+    with open(os.path.join(output_dir, LAYOUT_FILE), "w", encoding="utf-8") as f:
+        f.write(layout + "\n")
+
+
+class OutputLayout:
+    """Maps products to their folder under the output directory"""
+
+    def __init__(self, output_dir, layout=None):
+        self.output_dir = output_dir
+        self.layout = layout or detect_layout(output_dir)
+        if self.layout not in (FLAT, SHARDED):
+            raise ValueError(f"Unknown output layout: {self.layout}")
+        if self.layout == FLAT and not os.path.exists(
+            os.path.join(output_dir, LAYOUT_FILE)
+        ):
+            log.warning(
+                "%s uses the flat layout; run 'python storage_layout.py migrate %s' "
+                "to shard it",
+                output_dir,
+                output_dir,
+            )
+        else:
+            write_layout(output_dir, self.layout)
+
+    def product_folder(self, product_data):
+        product_id = product_data["product_id"]
+        if self.layout == FLAT:
+            product_name = safe_component(product_data["title"], limit=50)
+            return os.path.join(self.output_dir, f"{product_id}_{product_name}")
+        return sharded_folder(self.output_dir, product_id)
+
+
+class FilenameAllocator:
+    """Unique filenames per folder without probing the filesystem per file
+
+    Each folder's existing names are listed once, on first use, and every
+    name handed out afterwards is remembered in memory, so picking a free
+    name costs set lookups instead of one stat() per candidate.
+    """
+
+    def __init__(self):
+        self._folders = {}
+        self._lock = threading.Lock()
+
+    def allocate(self, folder, filename):
+        with self._lock:
+            taken = self._folders.get(folder)
+            if taken is None:
+                try:
+                    taken = set(os.listdir(folder))
+                except FileNotFoundError:
+                    taken = set()
+                self._folders[folder] = taken
+
+            base_name, ext = os.path.splitext(filename)
+            counter = 1
+            while filename in taken:
+                filename = f"{base_name}_{counter}{ext}"
+                counter += 1
+            taken.add(filename)
+            return filename
+
+    def release(self, folder):
+        """Forget a folder once nothing more will be written to it"""
+        with self._lock:
+            self._folders.pop(folder, None)
+
+
+def migrate(output_dir, dry_run=False):
+    """Move a flat output tree into the sharded layout; returns folders moved"""
+    moved = 0
+    with os.scandir(output_dir) as entries:
+        folders = [
+            entry.path
+            for entry in entries
+            if entry.is_dir() and _is_product_folder(entry.path)
+        ]
+
+    for folder in folders:
+        try:
+            json_path = os.path.join(folder, "product_data.json")
+            with open(json_path, "r", encoding="utf-8") as f:
+                product_id = json.load(f).get("product_id")
+        except (OSError, ValueError):
+            product_id = None
+        if not product_id:
+            product_id = os.path.basename(folder).split("_", 1)[0]
+
+        target = sharded_folder(output_dir, product_id)
+        if os.path.exists(target):
+            log.warning("Skipping %s: %s already exists", folder, target)
+            continue
+        if dry_run:
+            print(f"{folder} -> {target}")
+        else:
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            os.rename(folder, target)
+        moved += 1
+
+    if not dry_run:
+        write_layout(output_dir, SHARDED)
+    return moved
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage the scraper's output layout")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    migrate_parser = subparsers.add_parser(
+        "migrate", help="Move a flat output directory into the sharded layout"
+    )
+    migrate_parser.add_argument("output_dir")
+    migrate_parser.add_argument(
+        "--dry-run", action="store_true", help="Print the moves without making them"
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s %(message)s")
+    moved = migrate(args.output_dir, dry_run=args.dry_run)
+    print(f"{'Would move' if args.dry_run else 'Moved'} {moved} product folders")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+import threading
+import time
+
+# Context fields callers may attach with logger.info(..., extra={...})
+CONTEXT_FIELDS = ("product_id", "stage", "duration", "url", "status", "count")
+
+ROOT_LOGGER = "aliexpress"
+
+_listener = None
+
+
+class JsonFormatter(logging.Formatter):
+    """Format each record as one JSON line"""
+
+    def format(self, record):
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for field in CONTEXT_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = round(value, 4) if field == "duration" else value
+        suppressed = getattr(record, "suppressed", 0)
+        if suppressed:
+            entry["suppressed"] = suppressed
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class RateLimitFilter(logging.Filter):
+    """Let through at most one copy of a repeated warning/error per window
+
+    Records are grouped by logger, level and unformatted message, so the same
+    failure for different URLs collapses into one line. The next record let
+    through carries a ``suppressed`` count of what was dropped in between.
+    """
+
+    def __init__(self, window=30.0, min_level=logging.WARNING):
+        super().__init__()
+        self.window = window
+        self.min_level = min_level
+        self._lock = threading.Lock()
+        self._seen = {}
+
+    def filter(self, record):
+        if record.levelno < self.min_level:
+            return True
+        key = (record.name, record.levelno, record.msg)
+        now = time.monotonic()
+        with self._lock:
+            last, suppressed = self._seen.get(key, (None, 0))
+            if last is not None and now - last < self.window:
+                self._seen[key] = (last, suppressed + 1)
+                return False
+            self._seen[key] = (now, 0)
+        record.suppressed = suppressed
+        return True
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """Queue handler that drops records instead of blocking when the queue is full"""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def parse_module_levels(specs):
+    """Parse ["aliexpress.images=WARNING", ...] into {logger_name: level}"""
+    levels = {}
+    for spec in specs or []:
+        name, _, level = spec.partition("=")
+        if not level:
+            raise ValueError(f"Expected LOGGER=LEVEL, got {spec!r}")
+        name = name.strip()
+        if not name.startswith(ROOT_LOGGER):
+            name = f"{ROOT_LOGGER}.{name}"
+        levels[name] = level.strip().upper()
+    return levels
+
+
+def setup_logging(
+    level="INFO",
+    module_levels=None,
+    json_output=True,
+    stream=None,
+    log_file=None,
+    queue_size=10000,
+    rate_limit_window=30.0,
+):
+    """Route scraper logs through a bounded queue to a background writer thread"""
+    global _listener
+    shutdown_logging()
+
+    if json_output:
+        formatter = JsonFormatter()
+    else:
+        formatter = logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    handlers = []
+    stream_handler = logging.StreamHandler(stream or sys.stderr)
+    stream_handler.setFormatter(formatter)
+    handlers.append(stream_handler)
+    if log_file:
+        file_handler = logging.FileHandler(log_file, encoding="utf-8")
+        file_handler.setFormatter(formatter)
+        handlers.append(file_handler)
+
+    log_queue = queue.Queue(maxsize=queue_size)
+    queue_handler = DroppingQueueHandler(log_queue)
+    queue_handler.addFilter(RateLimitFilter(window=rate_limit_window))
+
+    root = logging.getLogger(ROOT_LOGGER)
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(level.upper() if isinstance(level, str) else level)
+    root.propagate = False
+
+    for name, module_level in (module_levels or {}).items():
+        logging.getLogger(name).setLevel(module_level)
+
+    _listener = logging.handlers.QueueListener(
+        log_queue, *handlers, respect_handler_level=True
+    )
+    _listener.start()
+    return queue_handler
+
+
+def shutdown_logging():
+    """Flush queued records and stop the writer thread"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
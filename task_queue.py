@@ -0,0 +1,358 @@
+import json
+import logging
+import sqlite3
+import threading
+import time
+
+log = logging.getLogger("aliexpress.queue")
+
+PENDING = "pending"
+LEASED = "leased"
+DONE = "done"
+FAILED = "failed"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tasks (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    dedupe_key TEXT UNIQUE,
+    state TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    available_at REAL NOT NULL,
+    lease_owner TEXT,
+    lease_expires REAL,
+    error TEXT,
+    updated REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS tasks_ready ON tasks (state, available_at, id);
+CREATE INDEX IF NOT EXISTS tasks_leases ON tasks (state, lease_expires);
+"""
+
+
+class TaskQueue:
+    """Leased work queue in a SQLite file, shared by coordinator and workers
+
+    Workers ``lease`` tasks for ``lease_time`` seconds and must
+    ``heartbeat`` to keep them; a lease that runs out (crashed or hung
+    worker) puts the task back to pending. Every lease counts as an attempt
+    and tasks that run out of ``max_attempts`` end up failed instead of
+    looping forever. All state changes run in IMMEDIATE transactions, so any
+    number of processes on one machine can share the file.
+    """
+
+    def __init__(self, path, max_attempts=3):
+        self.path = path
+        self.max_attempts = max_attempts
+        self._local = threading.local()
+        self._db().executescript(SCHEMA)
+
+    def _db(self):
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self._local.db = db
+        return db
+
+    def _transaction(self):
+        return _Transaction(self._db())
+
+    def publish(self, kind, payload, key=None, delay=0):
+        """Queue a task; returns False if a task with ``key`` already exists"""
+        now = time.time()
+        with self._transaction() as db:
+            cursor = db.execute(
+                "INSERT OR IGNORE INTO tasks (kind, payload, dedupe_key, available_at,"
+                " updated) VALUES (?, ?, ?, ?, ?)",
+                (kind, json.dumps(payload), key, now + delay, now),
+            )
+            return cursor.rowcount == 1
+
+    def publish_many(self, tasks):
+        """Queue (kind, payload, key) tuples in one transaction; returns count added"""
+        now = time.time()
+        with self._transaction() as db:
+            before = db.total_changes
+            db.executemany(
+                "INSERT OR IGNORE INTO tasks (kind, payload, dedupe_key, available_at,"
+                " updated) VALUES (?, ?, ?, ?, ?)",
+                (
+                    (kind, json.dumps(payload), key, now, now)
+                    for kind, payload, key in tasks
+                ),
+            )
+            return db.total_changes - before
+
+    def _requeue_expired(self, db, now):
+        db.execute(
+            "UPDATE tasks SET state = CASE WHEN attempts >= ? THEN 'failed'"
+            " ELSE 'pending' END, lease_owner = NULL, lease_expires = NULL,"
+            " error = COALESCE(error, 'lease expired'), updated = ?"
+            " WHERE state = 'leased' AND lease_expires < ?",
+            (self.max_attempts, now, now),
+        )
+
+    def requeue_expired(self):
+        """Put tasks whose lease ran out back in the queue"""
+        with self._transaction() as db:
+            self._requeue_expired(db, time.time())
+
+    def lease(self, worker_id, lease_time=120, kinds=None, limit=1):
+        """Lease up to ``limit`` ready tasks as [{id, kind, payload, attempts}]"""
+        now = time.time()
+        with self._transaction() as db:
+            self._requeue_expired(db, now)
+            query = (
+                "SELECT id, kind, payload, attempts FROM tasks"
+                " WHERE state = 'pending' AND available_at <= ?"
+            )
+            params = [now]
+            if kinds:
+                query += f" AND kind IN ({','.join('?' * len(kinds))})"
+                params.extend(kinds)
+            # Products before listings, so a crawl finishes what it has found
+            # before discovering more
+            query += " ORDER BY kind = 'product' DESC, id LIMIT ?"
+            params.append(limit)
+            rows = db.execute(query, params).fetchall()
+            tasks = []
+            for task_id, kind, payload, attempts in rows:
+                db.execute(
+                    "UPDATE tasks SET state = 'leased', lease_owner = ?,"
+                    " lease_expires = ?, attempts = attempts + 1, updated = ?"
+                    " WHERE id = ?",
+                    (worker_id, now + lease_time, now, task_id),
+                )
+                tasks.append(
+                    {
+                        "id": task_id,
+                        "kind": kind,
+                        "payload": json.loads(payload),
+                        "attempts": attempts + 1,
+                    }
+                )
+            return tasks
+
+    def heartbeat(self, worker_id, task_ids, lease_time=120):
+        """Extend this worker's leases; returns the ids it still holds"""
+        if not task_ids:
+            return []
+        now = time.time()
+        held = []
+        with self._transaction() as db:
+            for task_id in task_ids:
+                cursor = db.execute(
+                    "UPDATE tasks SET lease_expires = ?, updated = ?"
+                    " WHERE id = ? AND state = 'leased' AND lease_owner = ?",
+                    (now + lease_time, now, task_id, worker_id),
+                )
+                if cursor.rowcount:
+                    held.append(task_id)
+        return held
+
+    def _finish(self, task_id, worker_id, state, delay=0, count=True):
+        now = time.time()
+        if state == PENDING and count:
+            # A counted hand-back runs out of attempts just like fail()
+            new_state = "CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END"
+            params = [self.max_attempts]
+        else:
+            new_state, params = "?", [state]
+        with self._transaction() as db:
+            cursor = db.execute(
+                f"UPDATE tasks SET state = {new_state}, available_at = ?,"
+                " attempts = attempts - ?, lease_owner = NULL, lease_expires = NULL,"
+                " updated = ? WHERE id = ? AND state = 'leased' AND lease_owner = ?",
+                params + [now + delay, 0 if count else 1, now, task_id, worker_id],
+            )
+            return cursor.rowcount == 1
+
+    def complete(self, task_id, worker_id):
+        """Mark a leased task done; False if the lease was lost meanwhile"""
+        return self._finish(task_id, worker_id, DONE)
+
+    def fail(self, task_id, worker_id, error, retry_delay=30):
+        """Give a task back after an error; retried until max_attempts"""
+        now = time.time()
+        with self._transaction() as db:
+            cursor = db.execute(
+                "UPDATE tasks SET state = CASE WHEN attempts >= ? THEN 'failed'"
+                " ELSE 'pending' END, error = ?, available_at = ?,"
+                " lease_owner = NULL, lease_expires = NULL, updated = ?"
+                " WHERE id = ? AND state = 'leased' AND lease_owner = ?",
+                (
+                    self.max_attempts,
+                    str(error),
+                    now + retry_delay,
+                    now,
+                    task_id,
+                    worker_id,
+                ),
+            )
+            return cursor.rowcount == 1
+
+    def defer(self, task_id, worker_id, delay, count=False):
+        """Hand a task back to run after ``delay`` seconds (e.g. captcha cool-down)
+
+        By default this doesn't use up an attempt; with count=True the lease
+        counts and a task deferred at ``max_attempts`` ends up failed.
+        """
+        return self._finish(task_id, worker_id, PENDING, delay=delay, count=count)
+
+    def stats(self):
+        """Task counts as {state: count}, plus "ready" pending tasks due now"""
+        with self._transaction() as db:
+            counts = dict(
+                db.execute("SELECT state, COUNT(*) FROM tasks GROUP BY state")
+            )
+            counts["ready"] = db.execute(
+                "SELECT COUNT(*) FROM tasks"
+                " WHERE state = 'pending' AND available_at <= ?",
+                (time.time(),),
+            ).fetchone()[0]
+        for state in (PENDING, LEASED, DONE, FAILED):
+            counts.setdefault(state, 0)
+        return counts
+
+    def next_ready_in(self):
+        """Seconds until the next pending task is due, None if nothing is pending"""
+        with self._transaction() as db:
+            row = db.execute(
+                "SELECT MIN(available_at) FROM tasks WHERE state = 'pending'"
+            ).fetchone()
+        if row[0] is None:
+            return None
+        return max(0.0, row[0] - time.time())
+
+    def drained(self):
+        """True once nothing is pending or leased"""
+        counts = self.stats()
+        return counts[PENDING] == 0 and counts[LEASED] == 0
+
+    def serve(self, host="127.0.0.1", port=8765):
+        """Expose this queue to remote workers over XML-RPC (blocks)"""
+        server = make_queue_server(self, host, port)
+        log.info("Serving task queue %s on %s:%d", self.path, host, port)
+        server.serve_forever()
+
+
+class _Transaction:
+    """BEGIN IMMEDIATE ... COMMIT/ROLLBACK around a block"""
+
+    def __init__(self, db):
+        self.db = db
+
+    def __enter__(self):
+        self.db.execute("BEGIN IMMEDIATE")
+        return self.db
+
+    def __exit__(self, exc_type, exc, tb):
+        self.db.execute("ROLLBACK" if exc_type else "COMMIT")
+        return False
+
+
+QUEUE_METHODS = (
+    "publish",
+    "publish_many",
+    "requeue_expired",
+    "lease",
+    "heartbeat",
+    "complete",
+    "fail",
+    "defer",
+    "stats",
+    "next_ready_in",
+    "drained",
+)
+
+
+def make_queue_server(queue, host="127.0.0.1", port=8765):
+    """Threaded XML-RPC server exposing the queue methods"""
+    from socketserver import ThreadingMixIn
+    from xmlrpc.server import SimpleXMLRPCRequestHandler, SimpleXMLRPCServer
+
+    class Handler(SimpleXMLRPCRequestHandler):
+        def log_message(self, format, *args):
+            # One line per RPC would drown the coordinator's output
+            pass
+
+    class Server(ThreadingMixIn, SimpleXMLRPCServer):
+        daemon_threads = True
+
+    server = Server((host, port), requestHandler=Handler, allow_none=True)
+    for name in QUEUE_METHODS:
+        server.register_function(getattr(queue, name), name)
+    return server
+
+
+class RemoteTaskQueue:
+    """Client for a queue served by TaskQueue.serve, with the same methods"""
+
+    def __init__(self, url):
+        self.url = url
+        self._local = threading.local()
+
+    def _proxy(self):
+        # ServerProxy isn't thread-safe; the heartbeat thread gets its own
+        proxy = getattr(self._local, "proxy", None)
+        if proxy is None:
+            from xmlrpc.client import ServerProxy
+
+            proxy = ServerProxy(self.url, allow_none=True)
+            self._local.proxy = proxy
+        return proxy
+
+    def __getattr__(self, name):
+        if name not in QUEUE_METHODS:
+            raise AttributeError(name)
+        return getattr(self._proxy(), name)
+
+
+def connect_queue(spec, **options):
+    """TaskQueue for a SQLite path, RemoteTaskQueue for an http:// URL"""
+    if spec.startswith(("http://", "https://")):
+        return RemoteTaskQueue(spec)
+    return TaskQueue(spec, **options)
+
+
+class LeaseKeeper:
+    """Background heartbeats for the tasks a worker currently holds"""
+
+    def __init__(self, queue, worker_id, lease_time=120):
+        self.queue = queue
+        self.worker_id = worker_id
+        self.lease_time = lease_time
+        self._held = set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def hold(self, task_id):
+        with self._lock:
+            self._held.add(task_id)
+
+    def drop(self, task_id):
+        with self._lock:
+            self._held.discard(task_id)
+
+    def _run(self):
+        while not self._stop.wait(self.lease_time / 3):
+            with self._lock:
+                task_ids = list(self._held)
+            if not task_ids:
+                continue
+            try:
+                held = self.queue.heartbeat(self.worker_id, task_ids, self.lease_time)
+            except Exception as e:
+                log.warning("Heartbeat failed: %s", e)
+                continue
+            lost = set(task_ids) - set(held)
+            if lost:
+                log.warning("Lost leases on tasks %s", sorted(lost))
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join(timeout=5)
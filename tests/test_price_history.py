@@ -0,0 +1,51 @@
+from price_history import parse_price
+
+
+def test_single_price():
+    assert parse_price("US $12.34") == {"currency": "USD", "min": 1234, "max": 1234}
+
+
+def test_range():
+    assert parse_price("US $12.34 - 15.99") == {
+        "currency": "USD",
+        "min": 1234,
+        "max": 1599,
+    }
+    assert parse_price("US $12.34 - US $15.99")["max"] == 1599
+    assert parse_price("€1.234,50 - €2.000,00") == {
+        "currency": "EUR",
+        "min": 123450,
+        "max": 200000,
+    }
+
+
+def test_sale_price_followed_by_original_price():
+    assert parse_price("US $12.34US $20.00") == {
+        "currency": "USD",
+        "min": 1234,
+        "max": 1234,
+        "original": 2000,
+    }
+    assert parse_price("US $12.34US $20.00-38%") == {
+        "currency": "USD",
+        "min": 1234,
+        "max": 1234,
+        "original": 2000,
+    }
+
+
+def test_ignores_discounts_and_counts():
+    assert parse_price("US $12.34 -40%")["max"] == 1234
+    assert parse_price("US $0.99 5 sold") == {"currency": "USD", "min": 99, "max": 99}
+
+
+def test_thousands_separated_by_spaces():
+    assert parse_price("1 234,56 руб.") == {
+        "currency": "RUB",
+        "min": 123456,
+        "max": 123456,
+    }
+
+
+def test_no_number():
+    assert parse_price("Unknown Price") is None
@@ -0,0 +1,34 @@
+from task_queue import DONE, FAILED, PENDING, TaskQueue
+
+
+def _state(queue, task_id):
+    return queue._db().execute(
+        "SELECT state, attempts FROM tasks WHERE id = ?", (task_id,)
+    ).fetchone()
+
+
+def test_counted_defer_fails_after_max_attempts(tmp_path):
+    queue = TaskQueue(str(tmp_path / "queue.db"), max_attempts=3)
+    queue.publish("product", ["https://example.com/item/1.html"], key="1")
+
+    for attempt in range(1, 4):
+        (task,) = queue.lease("w1")
+        assert task["attempts"] == attempt
+        assert queue.defer(task["id"], "w1", 0, count=True)
+
+    assert _state(queue, task["id"]) == (FAILED, 3)
+    assert queue.lease("w1") == []
+    assert queue.drained()
+
+
+def test_uncounted_defer_keeps_the_attempt(tmp_path):
+    queue = TaskQueue(str(tmp_path / "queue.db"), max_attempts=1)
+    queue.publish("product", ["https://example.com/item/1.html"], key="1")
+
+    (task,) = queue.lease("w1")
+    assert queue.defer(task["id"], "w1", 0)
+    assert _state(queue, task["id"]) == (PENDING, 0)
+
+    (task,) = queue.lease("w1")
+    assert queue.complete(task["id"], "w1")
+    assert _state(queue, task["id"]) == (DONE, 1)